@@ -0,0 +1,90 @@
+import json
+
+import os
+
+import socket
+
+import sys
+
+# The client only forwards its arguments, so it imports neither the tools nor
+# argparse and starts about as fast as the interpreter does
+TOOLS = ("assemble", "translate", "analyze", "build")
+
+USAGE = f"usage: build_client.py [--socket SOCKET] {{{','.join(TOOLS)},stop}} ..."
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("TMPDIR", "/tmp"), f"nand2tetris-{os.getuid()}.sock"
+)
+
+# Options that read their input from stdin when given "-". The daemon does not
+# share the client's stdin, so the client reads it and sends it along.
+STDIN_OPTIONS = {"translate": "--vm"}
+
+
+def encode(message):
+    return (json.dumps(message) + "\n").encode()
+
+
+def decode(line):
+    return json.loads(line.decode())
+
+
+def request(socket_path, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(socket_path))
+        connection.sendall(encode(message))
+        connection.shutdown(socket.SHUT_WR)
+        response = b""
+        while True:
+            data = connection.recv(65536)
+            if len(data) == 0:
+                break
+            response += data
+    if len(response) == 0:
+        raise ValueError("the connection closed without a response")
+    return decode(response)
+
+
+def _reads_stdin(tool, args):
+    option = STDIN_OPTIONS.get(tool)
+    if option is None:
+        return False
+    for i, arg in enumerate(args):
+        if arg == f"{option}=-" or (arg == option and args[i + 1 : i + 2] == ["-"]):
+            return True
+    return False
+
+
+def main():
+    args = sys.argv[1:]
+    socket_path = DEFAULT_SOCKET
+    if len(args) >= 2 and args[0] == "--socket":
+        socket_path = args[1]
+        args = args[2:]
+    if len(args) == 0 or args[0] not in (*TOOLS, "stop"):
+        print(USAGE, file=sys.stderr)
+        sys.exit(2)
+
+    if "--watch" in args:
+        # The daemon answers once a tool returns, which a watch never does
+        print("--watch is not supported through the build daemon", file=sys.stderr)
+        sys.exit(2)
+
+    message = {"tool": args[0], "args": args[1:], "cwd": os.getcwd()}
+    if _reads_stdin(args[0], args[1:]):
+        message["stdin"] = sys.stdin.buffer.read().decode("UTF-8")
+    try:
+        response = request(socket_path, message)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"no build daemon is listening on {socket_path}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"bad response from the build daemon: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.exit(response["status"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+
+import asyncio
+
+import concurrent.futures
+
+import contextlib
+
+import io
+
+import multiprocessing
+
+import os
+
+import pathlib
+
+import signal
+
+import socket
+
+import sys
+
+import traceback
+
+import toolchain
+
+import assembler
+
+import jack_analyzer
+
+import vm_translator
+
+from build_client import DEFAULT_SOCKET, decode, encode
+
+# Every request runs the same main() as the command line, in a worker that
+# has the tools imported already
+TOOLS = {
+    "assemble": assembler.main,
+    "translate": vm_translator.main,
+    "analyze": jack_analyzer.main,
+    "build": toolchain.main,
+}
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    # sys.exit("message") prints the message and exits with 1
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run_tool(tool, args, cwd, stdin=""):
+    # Runs in a worker process, one request at a time, so the working
+    # directory, sys.argv and the redirected streams are its own. A tool that
+    # reads stdin gets what the client sent, and an immediate end of file
+    # otherwise.
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    os.chdir(cwd)
+    sys.argv = [tool, *args]
+    sys.stdin = io.TextIOWrapper(io.BytesIO(stdin.encode()), encoding="UTF-8")
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            TOOLS[tool]()
+            status = 0
+        except SystemExit as e:
+            status = _exit_status(e.code)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+    return {"status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+class BuildDaemon:
+    # Serves tool runs on a Unix socket. Each connection carries one request
+    # and gets one response, a line of JSON each; requests run concurrently on
+    # a pool of at most jobs worker processes and queue up beyond that.
+    def __init__(self, socket_path: pathlib.Path, jobs):
+        self._socket_path = socket_path
+        # Workers fork from a server that has imported the tools once. Forking
+        # them from this process would also hand them the open connections,
+        # which then never see EOF while the worker lives.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["toolchain"])
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=context
+        )
+        self._stopped = None
+
+    async def serve(self):
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stopped.set)
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(
+            self._handle, path=str(self._socket_path)
+        )
+        print(f"build daemon listening on {self._socket_path}", flush=True)
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            self._socket_path.unlink(missing_ok=True)
+            self._pool.shutdown(cancel_futures=True)
+
+    async def _handle(self, reader, writer):
+        try:
+            # The client closes its side after the request, which may carry
+            # more stdin than fits the stream's line limit
+            response = await self._respond(await reader.read())
+            writer.write(encode(response))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _respond(self, line):
+        try:
+            message = decode(line)
+            tool = message["tool"]
+            args = [str(arg) for arg in message.get("args", [])]
+            cwd = message.get("cwd", os.getcwd())
+            stdin = str(message.get("stdin", ""))
+        except (ValueError, KeyError, TypeError) as e:
+            return self._error(f"malformed request: {e}")
+        if tool == "stop":
+            self._stopped.set()
+            return {"status": 0, "stdout": "build daemon stopped\n", "stderr": ""}
+        if tool not in TOOLS:
+            return self._error(f"unknown tool: {tool}")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._pool, run_tool, tool, args, cwd, stdin
+            )
+        except Exception as e:
+            return self._error(f"{type(e).__name__}: {e}")
+
+    def _error(self, message):
+        return {"status": 1, "stdout": "", "stderr": f"{message}\n"}
+
+    def _remove_stale_socket(self):
+        if not self._socket_path.exists():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self._socket_path))
+            except ConnectionRefusedError:
+                # Left behind by a daemon that did not shut down cleanly
+                self._socket_path.unlink()
+                return
+        raise ValueError(f"a build daemon is already listening on {self._socket_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    daemon = BuildDaemon(pathlib.Path(args.socket), args.jobs)
+    asyncio.run(daemon.serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+def is_stream(source):
+    # Open files and stdin/stdout, as opposed to paths and lists of lines
+    return hasattr(source, "readline") or hasattr(source, "write")
+
+
+def _lex_lines(lines):
+    # Splits every line of an assembly or VM program into its whitespace
+    # separated fields, with // comments cut off and empty lines dropped
+    for line in lines:
+        comment_index = line.find("//")
+        if comment_index != -1:
+            line = line[:comment_index]
+        fields = line.split()
+        if len(fields) != 0:
+            yield fields
+
+
+def lex_fields(source):
+    # A path is read with one call and lexed into a list. A stream, such as
+    # stdin, is lexed lazily line by line so that it is never held in memory
+    # as a whole, and so is a list of lines that is in memory already.
+    if hasattr(source, "read") or isinstance(source, list):
+        return _lex_lines(source)
+    with open(source, "r", encoding="UTF-8") as f:
+        return list(_lex_lines(f.read().splitlines()))
+
+
+def _lex_command_lines(lines):
+    # Hack assembly has no whitespace inside a command, so each line becomes
+    # one string. Most lines have none to remove once they are stripped.
+    for line in lines:
+        comment_index = line.find("//")
+        if comment_index != -1:
+            line = line[:comment_index]
+        command = line.strip()
+        if len(command) != 0:
+            if " " in command or "\t" in command:
+                command = "".join(command.split())
+            yield command
+
+
+def lex_commands(source):
+    if hasattr(source, "read") or isinstance(source, list):
+        return _lex_command_lines(source)
+    with open(source, "r", encoding="UTF-8") as f:
+        return list(_lex_command_lines(f.read().splitlines()))
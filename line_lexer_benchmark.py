@@ -0,0 +1,144 @@
+import argparse
+
+import json
+
+import pathlib
+
+import tempfile
+
+import time
+
+from line_lexer import lex_commands, lex_fields
+
+ROOT = pathlib.Path(__file__).resolve().parent
+
+
+# The per-line readers that the parsers used before line_lexer.py, kept as
+# the reference the shared lexer is measured against
+def _readline_vm_fields(path):
+    commands = []
+    with open(path, "r", encoding="UTF-8") as f:
+        command = f.readline()
+        while len(command) != 0:
+            command = command.replace("\t", "")
+            command = command.replace("\n", "")
+            command_index = command.find("//")
+            if command_index != -1:
+                command = command[:command_index]
+            command = [c for c in command.split(" ") if " " not in c and len(c) != 0]
+            if len(command) != 0:
+                commands.append(command)
+            command = f.readline()
+    return commands
+
+
+def _readline_asm_commands(path):
+    commands = []
+    with open(path, "r", encoding="UTF-8") as f:
+        command = f.readline()
+        while len(command) != 0:
+            command = command[: command.find("//")]
+            command = command.replace(" ", "")
+            if len(command) != 0:
+                commands.append(command)
+            command = f.readline()
+    return commands
+
+
+def _vm_program(num_functions):
+    operators = ["add", "sub", "and", "or", "eq", "gt", "lt", "neg", "not"]
+    lines = []
+    for i in range(num_functions):
+        lines += [f"// function {i}", f"function Loop.f{i} 3", "label LOOP"]
+        for j in range(100):
+            lines += [f"push local {j % 3}", f"push constant {j} // operand"]
+            lines += [operators[j % len(operators)], f"pop local {(j + 1) % 3}"]
+        lines += ["push argument 0", "if-goto LOOP", "", "push local 0", "return"]
+    return "\n".join(lines) + "\n"
+
+
+def _asm_program(copies):
+    pong = (ROOT / "project6" / "pong" / "Pong.asm").read_text(encoding="UTF-8")
+    return pong * copies
+
+
+WORKLOADS = {
+    "vm": (
+        lambda scale: _vm_program(300 * scale),
+        lex_fields,
+        _readline_vm_fields,
+    ),
+    "asm": (
+        lambda scale: _asm_program(4 * scale),
+        lex_commands,
+        _readline_asm_commands,
+    ),
+}
+
+
+def _best_time(lex, path, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        commands = lex(path)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, commands
+
+
+def _lex_stream(lex):
+    def lex_stream(path):
+        with open(path, "r", encoding="UTF-8") as f:
+            return list(lex(f))
+
+    return lex_stream
+
+
+def run_workload(name, scale, repeat):
+    program, lex, reference = WORKLOADS[name]
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = pathlib.Path(work_dir) / f"{name}.txt"
+        path.write_text(program(scale), encoding="UTF-8")
+        reference_time, expected = _best_time(reference, path, repeat)
+        lexer_time, commands = _best_time(lex, path, repeat)
+        stream_time, streamed = _best_time(_lex_stream(lex), path, repeat)
+    if commands != expected or streamed != expected:
+        raise ValueError(f"{name}: line_lexer disagrees with the per-line reader")
+    return {
+        "commands": len(commands),
+        "readline_time": reference_time,
+        "lexer_time": lexer_time,
+        "stream_time": stream_time,
+        "speedup": reference_time / lexer_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workload", type=str, action="append", default=None)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=str, default=None)
+    args = parser.parse_args()
+
+    names = args.workload if args.workload is not None else list(WORKLOADS)
+    results = {}
+    for name in names:
+        result = run_workload(name, args.scale, args.repeat)
+        results[name] = result
+        print(
+            f"{name}: {result['commands']} commands, "
+            f"readline {result['readline_time']:.3f}s "
+            f"lexer {result['lexer_time']:.3f}s "
+            f"stream {result['stream_time']:.3f}s "
+            f"({result['speedup']:.1f}x)"
+        )
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+// Tests ArraysObjects.asm on the CPU emulator. ArraysObjects.asm comes from
+// python toolchain.py --source project10/ArraysObjects --emit vm --emit asm
+// with the classes of project10/StandInOS copied into the directory
+
+load ArraysObjects.asm,
+output-file ArraysObjects.out,
+compare-to ArraysObjects.cmp,
+
+repeat 25000 {
+  ticktock;
+}
+
+output-list RAM[8000]%D1.9.1 RAM[8001]%D1.9.1 RAM[8002]%D1.9.1 RAM[8003]%D1.9.1 RAM[8004]%D1.9.1
+            RAM[8005]%D1.9.1 RAM[8006]%D1.9.1 RAM[8007]%D1.9.1;
+output;
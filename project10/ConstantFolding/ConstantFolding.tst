@@ -0,0 +1,17 @@
+// Tests ConstantFolding.asm on the CPU emulator. ConstantFolding.asm comes from
+// python toolchain.py --source project10/ConstantFolding --emit vm --emit asm
+// with the classes of project10/StandInOS copied into the directory
+
+load ConstantFolding.asm,
+output-file ConstantFolding.out,
+compare-to ConstantFolding.cmp,
+
+repeat 15000 {
+  ticktock;
+}
+
+output-list RAM[8000]%D1.9.1 RAM[8001]%D1.9.1 RAM[8002]%D1.9.1 RAM[8003]%D1.9.1 RAM[8004]%D1.9.1
+            RAM[8005]%D1.9.1 RAM[8006]%D1.9.1 RAM[8007]%D1.9.1 RAM[8008]%D1.9.1 RAM[8009]%D1.9.1
+            RAM[8010]%D1.9.1 RAM[8011]%D1.9.1 RAM[8012]%D1.9.1 RAM[8013]%D1.9.1 RAM[8014]%D1.9.1
+            RAM[8015]%D1.9.1 RAM[8016]%D1.9.1 RAM[8017]%D1.9.1 RAM[8018]%D1.9.1 RAM[8019]%D1.9.1;
+output;
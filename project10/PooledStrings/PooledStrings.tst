@@ -0,0 +1,14 @@
+// Tests PooledStrings.asm on the CPU emulator. PooledStrings.asm comes from
+// python toolchain.py --source project10/PooledStrings --pool-strings --emit vm --emit asm
+// with the classes of project10/StandInOS copied into the directory
+
+load PooledStrings.asm,
+output-file PooledStrings.out,
+compare-to PooledStrings.cmp,
+
+repeat 45000 {
+  ticktock;
+}
+
+output-list RAM[8000]%D1.9.1 RAM[8001]%D1.9.1;
+output;
@@ -0,0 +1,16 @@
+// Tests PooledStrings on the VM emulator. The .vm files come from
+// python toolchain.py --source project10/PooledStrings --pool-strings --emit vm --emit asm
+// with the classes of project10/StandInOS copied into the directory
+
+load,  // loads all the VM files from the current folder
+output-file PooledStrings.out,
+compare-to PooledStrings.cmp,
+
+set sp 256,
+
+repeat 3000 {
+  vmstep;
+}
+
+output-list RAM[8000]%D1.9.1 RAM[8001]%D1.9.1;
+output;
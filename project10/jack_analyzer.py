@@ -1,11 +1,43 @@
 import pathlib
 
+import re
+
+import json
+
+import os
+
+import shutil
+
+import hashlib
+
+import sys
+
+import time
+
+import bisect
+
+import concurrent.futures
+
+from array import array
+
 from enum import Enum
 
 import argparse
 
+# tracing.py and watcher.py at the repository root are shared with the
+# assembler and the VM translator
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+import tracing
+
+import watcher
+
 
 class TokenType(Enum):
+    # Members are singletons, so identity hashing is safe and keeps the
+    # parser's frozenset and dispatch lookups out of Enum.__hash__
+    __hash__ = object.__hash__
+
     KEYWORD = 1
     SYMBOL = 2
     IDENTIFIER = 3
@@ -14,6 +46,8 @@ class TokenType(Enum):
 
 
 class KeyWord(Enum):
+    __hash__ = object.__hash__
+
     CLASS = 1
     METHOD = 2
     FUNCTION = 3
@@ -37,6 +71,171 @@ class KeyWord(Enum):
     THIS = 21
 
 
+TOKEN_TAGS = {
+    TokenType.KEYWORD: "keyword",
+    TokenType.SYMBOL: "symbol",
+    TokenType.IDENTIFIER: "identifier",
+    TokenType.INT_CONST: "integerConstant",
+    TokenType.STRING_CONST: "stringConstant",
+}
+
+
+def token_xml(token_type: TokenType, token) -> str:
+    if token_type == TokenType.SYMBOL:
+        replace_symbols = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+        token = replace_symbols.get(token, token)
+    elif token_type not in TOKEN_TAGS:
+        raise NotImplementedError(f"Unknown token: {token_type}")
+    tag = TOKEN_TAGS[token_type]
+    return f"<{tag}> {token} </{tag}>\n"
+
+
+class XmlEmitter:
+    # Collects XML output in a list and writes it to the file in one call.
+    # Markup for tags and tokens is rendered once and looked up afterwards.
+    SYMBOLS = "{}()[].,;+-*/&|<>=~"
+
+    def __init__(self):
+        self._chunks = []
+        self._open_tags = {}
+        self._close_tags = {}
+        # Keywords, symbols, identifiers and integers never share a value, so
+        # their markup is keyed by value alone. String constants are not cached.
+        self._string_const = TokenType.STRING_CONST
+        self._tokens = {
+            value: token_xml(token_type, value)
+            for token_type, values in (
+                (TokenType.SYMBOL, XmlEmitter.SYMBOLS),
+                (TokenType.KEYWORD, JackTokenizer.KEYWORD_MAP),
+            )
+            for value in values
+        }
+
+    def begin(self, tag):
+        markup = self._open_tags.get(tag)
+        if markup is None:
+            markup = self._tag(tag)[0]
+        self._chunks.append(markup)
+
+    def end(self, tag):
+        markup = self._close_tags.get(tag)
+        if markup is None:
+            markup = self._tag(tag)[1]
+        self._chunks.append(markup)
+
+    def token(self, token_type: TokenType, value):
+        if token_type is self._string_const:
+            self._chunks.append(token_xml(token_type, value))
+            return
+        text = self._tokens.get(value)
+        if text is None:
+            text = token_xml(token_type, value)
+            self._tokens[value] = text
+        self._chunks.append(text)
+
+    def tokens(self, tokens):
+        # token() for every (token type, value) pair, without a call per token
+        append = self._chunks.append
+        cached = self._tokens
+        string_const = self._string_const
+        for token_type, value in tokens:
+            if token_type is string_const:
+                append(token_xml(token_type, value))
+                continue
+            text = cached.get(value)
+            if text is None:
+                text = token_xml(token_type, value)
+                cached[value] = text
+            append(text)
+
+    def tree(self, root: "Node"):
+        # Walks the tree with an explicit stack; a tag name on the stack
+        # closes the node it belongs to
+        append = self._chunks.append
+        cached = self._tokens
+        string_const = self._string_const
+        stack = [root]
+        while len(stack) != 0:
+            node = stack.pop()
+            node_type = type(node)
+            if node_type is Terminal:
+                if node.token_type is string_const:
+                    append(token_xml(node.token_type, node.value))
+                    continue
+                text = cached.get(node.value)
+                if text is None:
+                    text = token_xml(node.token_type, node.value)
+                    cached[node.value] = text
+                append(text)
+            elif node_type is str:
+                append(self._close_tags.get(node) or self._tag(node)[1])
+            else:
+                append(self._open_tags.get(node.kind) or self._tag(node.kind)[0])
+                stack.append(node.kind)
+                stack.extend(reversed(node.children))
+
+    def write(self, outfile):
+        outfile.write("".join(self._chunks))
+        self._chunks = []
+
+    def _tag(self, tag):
+        markup = (f"<{tag}>\n", f"</{tag}>\n")
+        self._open_tags[tag] = markup[0]
+        self._close_tags[tag] = markup[1]
+        return markup
+
+
+class TokenBuffer:
+    # Parallel arrays of type codes and source offsets. The text of a token
+    # is sliced from the source only when it is asked for, and line numbers
+    # are worked out only when a position is.
+    TOKEN_TYPES = (None,) + tuple(TokenType)
+    INT_CONST_CODE = TokenType.INT_CONST.value
+
+    def __init__(self, source: str, types: array, starts: array, ends: array):
+        self.source = source
+        self.types = types
+        self.starts = starts
+        self.ends = ends
+        self._newlines = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def token_type(self, index) -> TokenType:
+        return TokenBuffer.TOKEN_TYPES[self.types[index]]
+
+    def text(self, index) -> str:
+        return self.source[self.starts[index] : self.ends[index]]
+
+    def value(self, index):
+        if self.types[index] == TokenBuffer.INT_CONST_CODE:
+            return int(self.text(index))
+        return self.text(index)
+
+    def __iter__(self):
+        # (token type, value) of every token
+        source = self.source
+        token_types = TokenBuffer.TOKEN_TYPES
+        int_const = TokenBuffer.INT_CONST_CODE
+        for code, start, end in zip(self.types, self.starts, self.ends):
+            if code == int_const:
+                yield TokenType.INT_CONST, int(source[start:end])
+            else:
+                yield token_types[code], source[start:end]
+
+    def position(self, index):
+        if self._newlines is None:
+            self._newlines = array(
+                "I", (match.start() for match in re.finditer("\n", self.source))
+            )
+        start = self.starts[index]
+        # Newlines before the token give its line and where that line starts
+        line = bisect.bisect_left(self._newlines, start)
+        line_start = self._newlines[line - 1] + 1 if line != 0 else 0
+        return line + 1, start - line_start + 1
+
+
 class JackTokenizer:
     KEYWORD_MAP = {
         "class": KeyWord.CLASS,
@@ -61,14 +260,39 @@ class JackTokenizer:
         "while": KeyWord.WHILE,
         "return": KeyWord.RETURN,
     }
-
-    def __init__(self, source):
+    # Skips white spaces and comments, then matches an integer, string,
+    # identifier or symbol. Strings are matched as a whole, so comment markers
+    # inside them are left alone. An unterminated /* comment runs to the end.
+    TOKEN_PATTERN = re.compile(
+        r"(?:\s+|//[^\n]*|/\*.*?(?:\*/|\Z))*(?:"
+        r"([0-9]+)"
+        r'|"([^"\n]*)"'
+        r"|([A-Za-z_][A-Za-z0-9_]*)"
+        r"|([{}()\[\].,;+\-*/&|<>=~])"
+        r")?",
+        re.DOTALL,
+    )
+    GROUP_TOKEN_TYPES = (
+        None,
+        TokenType.INT_CONST,
+        TokenType.STRING_CONST,
+        TokenType.IDENTIFIER,
+        TokenType.SYMBOL,
+    )
+
+    def __init__(self, source, text=None):
+        # Given text, it is tokenized instead of what the source file holds
         self._source_path = source
-        self._source_list = None
-        self._current_line = 0
+        self._text = text
+        self._file = None
+        self._source = None
         self._current_pos = 0
-        self._next_token = None
-        self._next_token_type = None
+        self._tokens = None
+        self._token_types = None
+        self._token_starts = None
+        self._token_ends = None
+        self._token_count = 0
+        self._token_index = 0
         self._current_token = None
         self._current_token_type = None
 
@@ -80,44 +304,52 @@ class JackTokenizer:
         self.close()
 
     def open(self):
-        self._file = open(self._source_path, "r", encoding="UTF-8")
-        self._source_list = self._remove_all_comments_and_new_line(self._file)
-        self._next_token, self._next_token_type = self._retrieve_next_token()
+        with tracing.span("tokenize"):
+            if self._text is not None:
+                self._source = self._text
+            else:
+                with open(self._source_path, "r", encoding="UTF-8") as f:
+                    self._source = f.read()
+            self._tokens = self._retrieve_all_tokens()
+            self._token_types = self._tokens.types
+            self._token_starts = self._tokens.starts
+            self._token_ends = self._tokens.ends
+            self._token_count = len(self._tokens)
+            tracing.count("tokens", self._token_count)
 
     def close(self):
-        if not self._file.closed:
+        if self._file is not None and not self._file.closed:
             self._file.close()
 
     def write_token(self, outfile):
-        token_type = self.token_type()
-        if token_type == TokenType.IDENTIFIER:
-            outfile.write(f"<identifier> {self._current_token} </identifier>\n")
-            return
-        if token_type == TokenType.INT_CONST:
-            outfile.write(
-                f"<integerConstant> {self._current_token} </integerConstant>\n"
-            )
-            return
-        if token_type == TokenType.KEYWORD:
-            outfile.write(f"<keyword> {self._current_token} </keyword>\n")
-            return
-        if token_type == TokenType.STRING_CONST:
-            outfile.write(f"<stringConstant> {self._current_token} </stringConstant>\n")
-            return
-        if token_type == TokenType.SYMBOL:
-            replace_symbols = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
-            symbol = replace_symbols.get(self._current_token, self._current_token)
-            outfile.write(f"<symbol> {symbol} </symbol>\n")
-            return
-        raise NotImplementedError(f"Unknown token: {token_type}")
+        outfile.write(token_xml(self.token_type(), self._current_token))
 
     def has_more_tokens(self) -> bool:
-        return self._next_token is not None
+        return self._token_index < self._token_count
 
     def advance(self):
-        self._current_token = self._next_token
-        self._current_token_type = self._next_token_type
-        self._next_token, self._next_token_type = self._retrieve_next_token()
+        # Reads the buffer's arrays directly, as this runs once per token
+        index = self._token_index
+        self._token_index = index + 1
+        if index >= self._token_count:
+            self._current_token = None
+            self._current_token_type = None
+            return
+        token = self._source[self._token_starts[index] : self._token_ends[index]]
+        code = self._token_types[index]
+        if code == TokenBuffer.INT_CONST_CODE:
+            token = int(token)
+        self._current_token = token
+        self._current_token_type = TokenBuffer.TOKEN_TYPES[code]
+
+    def tokens(self) -> TokenBuffer:
+        return self._tokens
+
+    def rewind(self):
+        # Restart from the first token without reading the source again
+        self._token_index = 0
+        self._current_token = None
+        self._current_token_type = None
 
     def token_type(self) -> TokenType:
         return self._current_token_type
@@ -140,184 +372,832 @@ class JackTokenizer:
     def current_token(self) -> str:
         return self._current_token
 
+    def position(self):
+        # (line, column) of the current token in the source file, 1-based
+        return self._tokens.position(self._token_index - 1)
+
+    def _retrieve_all_tokens(self):
+        # The pattern can match an empty string, so the matches run back to
+        # back over the whole source
+        types = array("B")
+        starts = array("I")
+        ends = array("I")
+        keywords = JackTokenizer.KEYWORD_MAP
+        identifier_group = JackTokenizer.GROUP_TOKEN_TYPES.index(TokenType.IDENTIFIER)
+        group_codes = [None]
+        group_codes += [
+            token_type.value for token_type in JackTokenizer.GROUP_TOKEN_TYPES[1:]
+        ]
+        keyword_code = TokenType.KEYWORD.value
+        for match in JackTokenizer.TOKEN_PATTERN.finditer(self._source):
+            group = match.lastindex
+            if group is None:
+                if match.end() == len(self._source):
+                    break
+                rest = self._source[match.end() :].split(maxsplit=1)
+                raise ValueError(f"Unknown token: {rest[0]}")
+            start, end = match.span(group)
+            code = group_codes[group]
+            if group == identifier_group and match.group(group) in keywords:
+                code = keyword_code
+            types.append(code)
+            starts.append(start)
+            ends.append(end)
+        return TokenBuffer(self._source, types, starts, ends)
+
+
+class StreamingJackTokenizer(JackTokenizer):
+    # Reads the source in chunks and keeps only the current and the next
+    # token, so memory does not grow with the size of the file. A token or
+    # comment that reaches the end of the window is matched again once the
+    # next chunk has been read. Cannot rewind.
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE):
+        super().__init__(source)
+        self._chunk_size = chunk_size
+        self._eof = False
+        self._next_token = None
+        self._current_position = None
+        self._scan_pos = 0
+        self._scan_line = 1
+        self._scan_line_start = 0
+
+    def open(self):
+        self._file = open(self._source_path, "r", encoding="UTF-8")
+        self._source = ""
+        self._current_pos = 0
+        self._next_token = self._read_token()
+
+    def has_more_tokens(self) -> bool:
+        return self._next_token[1] is not None
+
+    def advance(self):
+        token = self._next_token
+        self._current_token, self._current_token_type, self._current_position = token
+        if self._current_token_type is not None:
+            self._next_token = self._read_token()
+
+    def rewind(self):
+        raise ValueError("a streaming tokenizer cannot rewind")
+
+    def position(self):
+        return self._current_position
+
+    def _read_token(self):
+        # The token is copied out of the window before the next read drops it
+        token_type, start, end = self._retrieve_next_token()
+        if token_type is None:
+            return None, None, None
+        token = self._source[start:end]
+        if token_type == TokenType.INT_CONST:
+            token = int(token)
+        return token, token_type, self._locate(start)
+
     def _retrieve_next_token(self):
-        new_token = ""
+        # Same result as JackTokenizer._retrieve_next_token, with offsets into
+        # the current window
         while True:
-            if len(self._source_list) == self._current_line:
-                return None, None
-
-            line = self._source_list[self._current_line]
-            if len(line) <= self._current_pos:
-                self._current_line += 1
-                self._current_pos = 0
+            match = JackTokenizer.TOKEN_PATTERN.match(self._source, self._current_pos)
+            at_window_end = match.end() == len(self._source)
+            if not self._eof and (match.lastindex is None or at_window_end):
+                self._read_chunk()
                 continue
+            if match.lastindex is None:
+                if at_window_end:
+                    self._current_pos = match.end()
+                    return None, None, None
+                rest = self._source[match.end() :].split(maxsplit=1)
+                raise ValueError(f"Unknown token: {rest[0]}")
+
+            self._current_pos = match.end()
+            group = match.lastindex
+            token_type = JackTokenizer.GROUP_TOKEN_TYPES[group]
+            if token_type == TokenType.IDENTIFIER:
+                if match.group(group) in JackTokenizer.KEYWORD_MAP:
+                    token_type = TokenType.KEYWORD
+            return token_type, match.start(group), match.end(group)
+
+    def _locate(self, offset):
+        newlines = self._source.count("\n", self._scan_pos, offset)
+        if newlines != 0:
+            self._scan_line += newlines
+            self._scan_line_start = self._source.rfind("\n", 0, offset) + 1
+        self._scan_pos = offset
+        return self._scan_line, offset - self._scan_line_start + 1
+
+    def _read_chunk(self):
+        # Drop the consumed text, keeping line tracking relative to the window
+        consumed = self._current_pos
+        self._locate(consumed)
+        self._source = self._source[consumed:]
+        self._current_pos = 0
+        self._scan_pos -= consumed
+        self._scan_line_start -= consumed
 
-            new_char = line[self._current_pos]
-            self._current_pos += 1
-            if new_char == " " or new_char == "\t":
-                if len(new_token) != 0:
-                    try:
-                        new_token = int(new_token)
-                        return new_token, TokenType.INT_CONST
-                    except:
-                        return new_token, TokenType.IDENTIFIER
-                else:
-                    continue
-            if new_char == '"':
-                if len(new_token) != 0:
-                    raise ValueError("token length should not be 0")
-                string_const_end = line[self._current_pos :].find('"')
-                new_token = line[
-                    self._current_pos : self._current_pos + string_const_end
-                ]
-                self._current_pos = self._current_pos + string_const_end + 1
-                return new_token, TokenType.STRING_CONST
-
-            if self._is_symbol(new_char):
-                if len(new_token) != 0:
-                    self._current_pos -= 1
-                    try:
-                        new_token = int(new_token)
-                        return new_token, TokenType.INT_CONST
-                    except:
-                        return new_token, TokenType.IDENTIFIER
-                else:
-                    return new_char, TokenType.SYMBOL
-            new_token += new_char
-            if self._is_keyword(new_token):
-                return new_token, TokenType.KEYWORD
-
-    def _is_symbol(self, value: str):
-        if len(value) != 1:
+        chunk = self._file.read(self._chunk_size)
+        if len(chunk) == 0:
+            self._eof = True
+        self._source += chunk
+
+
+class Terminal:
+    __slots__ = ("token_type", "value")
+
+    def __init__(self, token_type: TokenType, value):
+        self.token_type = token_type
+        self.value = value
+
+
+class Node:
+    __slots__ = ("kind", "children")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.children = []
+
+
+class ParseTreeBuilder:
+    def __init__(self):
+        self._stack = [Node(None)]
+        self._children = self._stack[-1].children
+
+    def begin(self, kind):
+        node = Node(kind)
+        self._children.append(node)
+        self._stack.append(node)
+        self._children = node.children
+
+    def end(self, kind):
+        node = self._stack.pop()
+        if node.kind != kind:
+            raise ValueError(f"unbalanced parse tree: {node.kind} closed as {kind}")
+        self._children = self._stack[-1].children
+
+    def token(self, token_type, value):
+        self._children.append(Terminal(token_type, value))
+
+    def root(self) -> Node:
+        if len(self._stack) != 1 or len(self._stack[0].children) != 1:
+            raise ValueError("parse tree is not complete")
+        return self._stack[0].children[0]
+
+
+class XmlStreamBuilder:
+    # Takes the same events as ParseTreeBuilder but writes them out as XML
+    # right away, so memory stays bounded by the nesting depth instead of
+    # growing with the size of the class. Only tokens are counted towards a
+    # flush, as the tags between two tokens are bounded by the nesting depth.
+    FLUSH_TOKENS = 4096
+
+    def __init__(self, outfile):
+        self._outfile = outfile
+        self._emitter = XmlEmitter()
+        self._kinds = []
+        self._pending = XmlStreamBuilder.FLUSH_TOKENS
+
+    def begin(self, kind):
+        self._kinds.append(kind)
+        self._emitter.begin(kind)
+
+    def end(self, kind):
+        open_kind = self._kinds.pop()
+        if open_kind != kind:
+            raise ValueError(f"unbalanced parse tree: {open_kind} closed as {kind}")
+        self._emitter.end(kind)
+
+    def token(self, token_type, value):
+        self._emitter.token(token_type, value)
+        self._pending -= 1
+        if self._pending == 0:
+            self._emitter.write(self._outfile)
+            self._pending = XmlStreamBuilder.FLUSH_TOKENS
+
+    def root(self):
+        if len(self._kinds) != 0:
+            raise ValueError("parse tree is not complete")
+        self._emitter.write(self._outfile)
+        return None
+
+
+class XmlBackend:
+    def write(self, tree: Node, outfile):
+        emitter = XmlEmitter()
+        emitter.tree(tree)
+        emitter.write(outfile)
+
+
+class JsonBackend:
+    def write(self, tree: Node, outfile):
+        # Written without indentation and with an explicit stack, as json.dump
+        # recurses per nesting level and indenting deep trees grows
+        # quadratically. Strings on the stack are written as they are.
+        chunks = []
+        stack = [tree]
+        while len(stack) != 0:
+            node = stack.pop()
+            if isinstance(node, str):
+                chunks.append(node)
+            elif isinstance(node, Terminal):
+                chunks.append(
+                    f'{{"type":{json.dumps(TOKEN_TAGS[node.token_type])},'
+                    f'"value":{json.dumps(node.value)}}}'
+                )
+            else:
+                chunks.append(f'{{"kind":{json.dumps(node.kind)},"children":[')
+                stack.append("]}")
+                for i in range(len(node.children) - 1, -1, -1):
+                    stack.append(node.children[i])
+                    if i != 0:
+                        stack.append(",")
+        chunks.append("\n")
+        outfile.write("".join(chunks))
+
+
+class SymbolTable:
+    # Class and subroutine scopes map a name to (segment, type, index), so a
+    # lookup is one or two dict accesses. The subroutine scope shadows the
+    # class scope and is replaced for every subroutine.
+    SEGMENTS = {
+        "static": "static",
+        "field": "this",
+        "argument": "argument",
+        "var": "local",
+    }
+    CLASS_KINDS = frozenset(["static", "field"])
+
+    def __init__(self):
+        self._class_scope = {}
+        self._subroutine_scope = {}
+        self._counts = dict.fromkeys(SymbolTable.SEGMENTS, 0)
+
+    def start_subroutine(self):
+        self._subroutine_scope = {}
+        self._counts["argument"] = 0
+        self._counts["var"] = 0
+
+    def define(self, name, symbol_type, kind):
+        if kind in SymbolTable.CLASS_KINDS:
+            scope = self._class_scope
+        else:
+            scope = self._subroutine_scope
+        if name in scope:
+            raise ValueError(f"{name} is already defined")
+        scope[name] = (SymbolTable.SEGMENTS[kind], symbol_type, self._counts[kind])
+        self._counts[kind] += 1
+        tracing.count("jack_symbols")
+
+    def var_count(self, kind):
+        return self._counts[kind]
+
+    def lookup(self, name):
+        symbol = self._subroutine_scope.get(name)
+        if symbol is None:
+            symbol = self._class_scope.get(name)
+        return symbol
+
+
+# Class generated for --pool-strings that builds every distinct string
+# constant of the program once
+STRING_POOL = "StringPool"
+
+# RAM[16..255], shared by the statics of every class of a program and the
+# variables that the VM translator's return code keeps there (FRAME and RET)
+STATIC_SEGMENT_SIZE = 240
+TRANSLATOR_VARIABLES = 2
+
+
+def _wrap(value):
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+class VMWriter:
+    # Collects VM commands in a list that is handed over in one piece
+    def __init__(self):
+        self._lines = []
+        # (value, first line, end line) of the constants written last, kept
+        # while nothing else follows them so that they can be folded
+        self._constants = []
+
+    def write_constant(self, value):
+        value = _wrap(value)
+        start = len(self._lines)
+        if len(self._constants) != 0 and self._constants[-1][2] != start:
+            self._constants = []
+        if value >= 0:
+            self._lines.append(f"push constant {value}")
+        else:
+            self._lines.append(f"push constant {~value}")
+            self._lines.append("not")
+        self._constants.append((value, start, len(self._lines)))
+
+    def trailing_constants(self, count):
+        # Values of the last count commands if all of them are constants
+        constants = self._constants[-count:]
+        if len(constants) != count or constants[-1][2] != len(self._lines):
+            return None
+        for previous, constant in zip(constants, constants[1:]):
+            if previous[2] != constant[1]:
+                return None
+        return [constant[0] for constant in constants]
+
+    def drop_constants(self, count):
+        del self._lines[self._constants[-count][1] :]
+        del self._constants[-count:]
+
+    def write_push(self, segment, index):
+        self._lines.append(f"push {segment} {index}")
+
+    def write_pop(self, segment, index):
+        self._lines.append(f"pop {segment} {index}")
+
+    def write_arithmetic(self, command):
+        self._lines.append(command)
+
+    def write_label(self, label):
+        self._lines.append(f"label {label}")
+
+    def write_goto(self, label):
+        self._lines.append(f"goto {label}")
+
+    def write_if(self, label):
+        self._lines.append(f"if-goto {label}")
+
+    def write_call(self, function_name, num_args):
+        self._lines.append(f"call {function_name} {num_args}")
+
+    def write_function(self, function_name, num_locals):
+        self._lines.append(f"function {function_name} {num_locals}")
+
+    def write_return(self):
+        self._lines.append("return")
+
+    def commands(self):
+        lines = self._lines
+        self._lines = []
+        self._constants = []
+        return lines
+
+
+def _write_string_constant(writer: VMWriter, value):
+    writer.write_push("constant", len(value))
+    writer.write_call("String.new", 1)
+    for char in value:
+        writer.write_push("constant", ord(char))
+        writer.write_call("String.appendChar", 2)
+
+
+class VmBackend:
+    # Compiles the parse tree of a class to VM code in a single walk. Jack
+    # declares class variables before subroutines and locals before
+    # statements, so every symbol is defined before it is used.
+    BINARY_COMMANDS = {
+        "+": "add",
+        "-": "sub",
+        "&": "and",
+        "|": "or",
+        "<": "lt",
+        ">": "gt",
+        "=": "eq",
+    }
+    BINARY_CALLS = {"*": "Math.multiply", "/": "Math.divide"}
+    UNARY_COMMANDS = {"-": "neg", "~": "not"}
+    FOLDS = {
+        "+": lambda x, y: x + y,
+        "-": lambda x, y: x - y,
+        "*": lambda x, y: x * y,
+        "&": lambda x, y: x & y,
+        "|": lambda x, y: x | y,
+        "<": lambda x, y: -1 if x < y else 0,
+        ">": lambda x, y: -1 if x > y else 0,
+        "=": lambda x, y: -1 if x == y else 0,
+    }
+    UNARY_FOLDS = {"-": lambda x: -x, "~": lambda x: ~x}
+
+    def __init__(self, pool_strings=False):
+        self._pool_strings = pool_strings
+        self._statement_dispatch = {
+            "letStatement": self._compile_let,
+            "ifStatement": self._compile_if,
+            "whileStatement": self._compile_while,
+            "doStatement": self._compile_do,
+            "returnStatement": self._compile_return,
+        }
+
+    def write(self, tree: Node, outfile):
+        outfile.write("".join(f"{command}\n" for command in self.compile(tree)))
+
+    def compile(self, tree: Node):
+        self._writer = VMWriter()
+        self._symbols = SymbolTable()
+        self._class_name = tree.children[1].value
+        self._string_slots = {}
+        for member in tree.children[3:-1]:
+            if member.kind == "classVarDec":
+                self._define_variables(member, member.children[0].value)
+            else:
+                self._compile_subroutine(member)
+        if len(self._string_slots) != 0:
+            self._write_string_setter()
+        return self._writer.commands()
+
+    def _define_variables(self, declaration, kind):
+        # static/field/var, type, name, then ", name" pairs up to ";"
+        symbol_type = declaration.children[1].value
+        for name in declaration.children[2:-1:2]:
+            self._symbols.define(name.value, symbol_type, kind)
+
+    def _compile_subroutine(self, subroutine):
+        kind, _, name, _, parameters, _, body = subroutine.children
+        self._symbols.start_subroutine()
+        self._if_count = 0
+        self._while_count = 0
+        if kind.value == "method":
+            self._symbols.define("this", self._class_name, "argument")
+        parameters = parameters.children
+        for i in range(0, len(parameters), 3):
+            self._symbols.define(
+                parameters[i + 1].value, parameters[i].value, "argument"
+            )
+        for var_dec in body.children[1:-2]:
+            self._define_variables(var_dec, "var")
+
+        self._writer.write_function(
+            f"{self._class_name}.{name.value}", self._symbols.var_count("var")
+        )
+        if kind.value == "constructor":
+            self._writer.write_push("constant", self._symbols.var_count("field"))
+            self._writer.write_call("Memory.alloc", 1)
+            self._writer.write_pop("pointer", 0)
+        elif kind.value == "method":
+            self._writer.write_push("argument", 0)
+            self._writer.write_pop("pointer", 0)
+        if self._pool_strings and self._class_name == "Main" and name.value == "main":
+            # Main.main runs once at start up, before any other class code
+            self._writer.write_call(f"{STRING_POOL}.init", 0)
+            self._writer.write_pop("temp", 0)
+        self._compile_statements(body.children[-2])
+
+    def _compile_statements(self, statements):
+        for statement in statements.children:
+            self._statement_dispatch[statement.kind](statement.children)
+
+    def _compile_let(self, children):
+        segment, _, index = self._variable(children[1].value)
+        if children[2].value == "[":
+            self._writer.write_push(segment, index)
+            self._compile_expression(children[3])
+            self._writer.write_arithmetic("add")
+            self._compile_expression(children[6])
+            self._writer.write_pop("temp", 0)
+            self._writer.write_pop("pointer", 1)
+            self._writer.write_push("temp", 0)
+            self._writer.write_pop("that", 0)
+        else:
+            self._compile_expression(children[3])
+            self._writer.write_pop(segment, index)
+
+    def _compile_if(self, children):
+        count = self._if_count
+        self._if_count += 1
+        self._compile_expression(children[2])
+        self._writer.write_if(f"IF_TRUE{count}")
+        self._writer.write_goto(f"IF_FALSE{count}")
+        self._writer.write_label(f"IF_TRUE{count}")
+        self._compile_statements(children[5])
+        if len(children) > 7:
+            self._writer.write_goto(f"IF_END{count}")
+            self._writer.write_label(f"IF_FALSE{count}")
+            self._compile_statements(children[9])
+            self._writer.write_label(f"IF_END{count}")
+        else:
+            self._writer.write_label(f"IF_FALSE{count}")
+
+    def _compile_while(self, children):
+        count = self._while_count
+        self._while_count += 1
+        self._writer.write_label(f"WHILE_EXP{count}")
+        self._compile_expression(children[2])
+        self._writer.write_arithmetic("not")
+        self._writer.write_if(f"WHILE_END{count}")
+        self._compile_statements(children[5])
+        self._writer.write_goto(f"WHILE_EXP{count}")
+        self._writer.write_label(f"WHILE_END{count}")
+
+    def _compile_do(self, children):
+        self._compile_items(self._call_items(children[1:-1]))
+        self._writer.write_pop("temp", 0)
+
+    def _compile_return(self, children):
+        if len(children) == 3:
+            self._compile_expression(children[1])
+        else:
+            self._writer.write_push("constant", 0)
+        self._writer.write_return()
+
+    def _compile_expression(self, expression):
+        self._compile_items([expression])
+
+    def _compile_items(self, items):
+        # Post-order walk with an explicit stack, so that nesting depth is
+        # not limited by recursion, as in the parser. Tuples on the stack are
+        # writer calls to make once the operands before them are compiled.
+        stack = list(reversed(items))
+        while len(stack) != 0:
+            item = stack.pop()
+            if isinstance(item, tuple):
+                item[0](*item[1:])
+            elif item.kind == "expression":
+                stack.extend(reversed(self._expression_items(item.children)))
+            else:
+                stack.extend(reversed(self._term_items(item.children)))
+
+    def _expression_items(self, children):
+        # term (op term)*, all operators have the same precedence
+        items = [children[0]]
+        if (
+            len(children) > 1
+            and children[1].value == "*"
+            and self._is_int_constant(children[0])
+        ):
+            # A constant has no side effects, so c * x can be compiled as
+            # x * c and reduced like it
+            items = [children[2], children[0], (self._write_binary, "*")]
+            children = children[2:]
+        for i in range(1, len(children), 2):
+            items.append(children[i + 1])
+            items.append((self._write_binary, children[i].value))
+        return items
+
+    def _is_int_constant(self, term):
+        return (
+            len(term.children) == 1
+            and term.children[0].token_type == TokenType.INT_CONST
+        )
+
+    def _write_binary(self, operator):
+        operands = self._writer.trailing_constants(2)
+        if operands is not None:
+            value = self._fold(operator, *operands)
+            if value is not None:
+                self._writer.drop_constants(2)
+                self._writer.write_constant(value)
+                return
+        operand = self._writer.trailing_constants(1)
+        if operand is not None and self._reduce(operator, operand[0]):
+            return
+        if operator in VmBackend.BINARY_CALLS:
+            self._writer.write_call(VmBackend.BINARY_CALLS[operator], 2)
+        else:
+            self._writer.write_arithmetic(VmBackend.BINARY_COMMANDS[operator])
+
+    def _write_unary(self, operator):
+        operand = self._writer.trailing_constants(1)
+        if operand is not None:
+            self._writer.drop_constants(1)
+            self._writer.write_constant(VmBackend.UNARY_FOLDS[operator](operand[0]))
+        else:
+            self._writer.write_arithmetic(VmBackend.UNARY_COMMANDS[operator])
+
+    def _fold(self, operator, x, y):
+        if operator == "/":
+            # Truncates toward zero like Math.divide, division by zero is
+            # left to fail at run time
+            if y == 0:
+                return None
+            quotient = abs(x) // abs(y)
+            return quotient if (x < 0) == (y < 0) else -quotient
+        return VmBackend.FOLDS[operator](x, y)
+
+    def _reduce(self, operator, constant):
+        # Rewrites x op constant when it has a cheaper form than the general
+        # one. The VM has no shift, so multiplying by 2^k doubles x k times
+        # through temp 0 instead of calling Math.multiply.
+        if operator in ("+", "-", "|") and constant == 0:
+            self._writer.drop_constants(1)
+            return True
+        if operator == "/" and (constant == 1 or constant == -1):
+            self._writer.drop_constants(1)
+            if constant == -1:
+                self._writer.write_arithmetic("neg")
+            return True
+        if operator != "*":
             return False
-        defined_symbols = [
-            "{",
-            "}",
-            "(",
-            ")",
-            "[",
-            "]",
-            ".",
-            ",",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "&",
-            "|",
-            "<",
-            ">",
-            "=",
-            "~",
-        ]
-        return value in defined_symbols
-
-    def _is_keyword(self, value: str):
-        return value in JackTokenizer.KEYWORD_MAP.keys()
-
-    def _remove_all_comments_and_new_line(self, f):
-        source_lines = []
-        multirow_comment_active = False
-        for line in f.readlines():
-            line = line[:-1]
-
-            single_comment_index = line.find("//")
-            if single_comment_index != -1:
-                line = line[:single_comment_index]
-
-            multi_comment_start_index = line.find("/*")
-            multi_comment_end_index = line.find("*/")
-            if multi_comment_start_index != -1 and multi_comment_end_index != -1:
-                line = line[:multi_comment_start_index]
-                line += line[multi_comment_end_index + 2 :]
-            elif multi_comment_start_index != -1 and not multirow_comment_active:
-                line = line[:multi_comment_start_index]
-                multirow_comment_active = True
-            elif multi_comment_end_index != -1 and multirow_comment_active:
-                line = line[multi_comment_end_index + 2 :]
-                multirow_comment_active = False
-            elif multirow_comment_active:
-                line = ""
-            source_lines.append(line)
-
-        return source_lines
+        if constant == 0:
+            self._writer.drop_constants(1)
+            self._writer.write_pop("temp", 0)
+            self._writer.write_constant(0)
+            return True
+        magnitude = constant & 0xFFFF
+        negate = False
+        if magnitude & (magnitude - 1) != 0:
+            magnitude = -constant
+            negate = True
+            if magnitude & (magnitude - 1) != 0:
+                return False
+        self._writer.drop_constants(1)
+        for _ in range(magnitude.bit_length() - 1):
+            self._writer.write_pop("temp", 0)
+            self._writer.write_push("temp", 0)
+            self._writer.write_push("temp", 0)
+            self._writer.write_arithmetic("add")
+        if negate:
+            self._writer.write_arithmetic("neg")
+        return True
+
+    def _term_items(self, children):
+        first = children[0]
+        token_type = first.token_type
+        if token_type == TokenType.INT_CONST:
+            self._writer.write_constant(first.value)
+        elif token_type == TokenType.STRING_CONST:
+            self._write_string(first.value)
+        elif token_type == TokenType.KEYWORD:
+            self._write_keyword_constant(first.value)
+        elif token_type == TokenType.SYMBOL:
+            if first.value == "(":
+                return [children[1]]
+            return [children[1], (self._write_unary, first.value)]
+        elif len(children) == 1:
+            self._push_variable(first.value)
+        elif children[1].value == "[":
+            self._push_variable(first.value)
+            return [
+                children[2],
+                (self._writer.write_arithmetic, "add"),
+                (self._writer.write_pop, "pointer", 1),
+                (self._writer.write_push, "that", 0),
+            ]
+        else:
+            return self._call_items(children)
+        return []
+
+    def _call_items(self, parts):
+        # name ( expressionList ) or receiver . name ( expressionList )
+        arguments = parts[-2].children[::2]
+        if parts[1].value == ".":
+            receiver = parts[0].value
+            symbol = self._symbols.lookup(receiver)
+            if symbol is None:
+                function_name = f"{receiver}.{parts[2].value}"
+                num_args = len(arguments)
+            else:
+                segment, symbol_type, index = symbol
+                self._writer.write_push(segment, index)
+                function_name = f"{symbol_type}.{parts[2].value}"
+                num_args = len(arguments) + 1
+        else:
+            self._writer.write_push("pointer", 0)
+            function_name = f"{self._class_name}.{parts[0].value}"
+            num_args = len(arguments) + 1
+        return arguments + [(self._writer.write_call, function_name, num_args)]
+
+    def _write_string(self, value):
+        if self._pool_strings:
+            # Pooled strings live in statics after the declared ones and are
+            # set once by the string pool through the $strings function
+            slot = self._string_slots.setdefault(value, len(self._string_slots))
+            self._writer.write_push("static", self._symbols.var_count("static") + slot)
+            return
+        _write_string_constant(self._writer, value)
+
+    def _write_string_setter(self):
+        base = self._symbols.var_count("static")
+        self._writer.write_function(f"{self._class_name}.$strings", 0)
+        for slot in range(len(self._string_slots)):
+            self._writer.write_push("argument", slot)
+            self._writer.write_pop("static", base + slot)
+        self._writer.write_constant(0)
+        self._writer.write_return()
+
+    def _write_keyword_constant(self, keyword):
+        if keyword == "this":
+            self._writer.write_push("pointer", 0)
+        elif keyword == "true":
+            self._writer.write_constant(-1)
+        else:
+            self._writer.write_constant(0)
+
+    def _push_variable(self, name):
+        segment, _, index = self._variable(name)
+        self._writer.write_push(segment, index)
+
+    def _variable(self, name):
+        symbol = self._symbols.lookup(name)
+        if symbol is None:
+            raise ValueError(f"{name} is not defined in {self._class_name}")
+        return symbol
+
+
+BACKENDS = {"xml": XmlBackend, "json": JsonBackend, "vm": VmBackend}
 
 
 class CompilationEngine:
     _tokenizer: JackTokenizer
 
-    def __init__(self, tokenizer: JackTokenizer, outfile):
+    SUBROUTINE_KEYWORDS = frozenset(
+        [KeyWord.CONSTRUCTOR, KeyWord.FUNCTION, KeyWord.METHOD]
+    )
+    CLASS_VAR_KEYWORDS = frozenset([KeyWord.STATIC, KeyWord.FIELD])
+    TYPE_KEYWORDS = frozenset([KeyWord.INT, KeyWord.BOOLEAN, KeyWord.CHAR])
+    RETURN_TYPE_KEYWORDS = TYPE_KEYWORDS | {KeyWord.VOID}
+    KEYWORD_CONSTANTS = frozenset(
+        [KeyWord.TRUE, KeyWord.FALSE, KeyWord.NULL, KeyWord.THIS]
+    )
+    BINARY_OPERATORS = frozenset("+-*/&|<>=")
+    UNARY_OPERATORS = frozenset("-~")
+    CONSTANT_TOKEN_TYPES = frozenset([TokenType.INT_CONST, TokenType.STRING_CONST])
+
+    def __init__(self, tokenizer: JackTokenizer, outfile=None, builder=None):
         self._tokenizer = tokenizer
         self._outfile = outfile
-
-    def compile(self):
-        self.compile_class()
+        self._builder = builder if builder is not None else ParseTreeBuilder()
+        self._class_member_dispatch = {
+            KeyWord.CONSTRUCTOR: self.compile_subroutine,
+            KeyWord.FUNCTION: self.compile_subroutine,
+            KeyWord.METHOD: self.compile_subroutine,
+            KeyWord.STATIC: self.compile_class_var_dec,
+            KeyWord.FIELD: self.compile_class_var_dec,
+        }
+        self._statement_dispatch = {
+            KeyWord.LET: self.compile_let,
+            KeyWord.IF: self.compile_if,
+            KeyWord.WHILE: self.compile_while,
+            KeyWord.DO: self.compile_do,
+            KeyWord.RETURN: self.compile_return,
+        }
+
+    def compile(self) -> Node:
+        with tracing.span("parse"):
+            self.compile_class()
+        tree = self._builder.root()
+        if self._outfile is not None:
+            XmlBackend().write(tree, self._outfile)
+        return tree
+
+    def _write_token(self):
+        self._builder.token(
+            self._tokenizer.token_type(), self._tokenizer.current_token()
+        )
 
     def compile_class(self):
-        self._outfile.write("<class>\n")
+        self._builder.begin("class")
 
         token_type = self._tokenizer.token_type()
-        print(f"token type: {str(token_type)}")
         if token_type != TokenType.KEYWORD:
             raise ValueError(f"trying to compile class but keyword not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.IDENTIFIER:
             raise ValueError("trying to compile class but could not find an identifier")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             raise ValueError("trying to compile class but could not find symbol '{'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         while self._tokenizer.token_type() == TokenType.KEYWORD:
             keyword = self._tokenizer.keyword()
-            SUBROUTINE_KEYS = [KeyWord.CONSTRUCTOR, KeyWord.FUNCTION, KeyWord.METHOD]
-            CLASS_VAR_KEYS = [KeyWord.FIELD, KeyWord.STATIC]
-            if keyword not in SUBROUTINE_KEYS + CLASS_VAR_KEYS:
+            compile_member = self._class_member_dispatch.get(keyword)
+            if compile_member is None:
                 raise ValueError(
                     f"trying to compile class but found unexpected keyword: {keyword}"
                 )
-            if keyword in SUBROUTINE_KEYS:
-                self.compile_subroutine()
-            if keyword in CLASS_VAR_KEYS:
-                self.compile_class_var_dec()
+            compile_member()
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             raise ValueError("trying to compile class but could not find symbol '}'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</class>\n")
+        self._builder.end("class")
 
     def compile_class_var_dec(self):
-        self._outfile.write("<classVarDec>\n")
+        self._builder.begin("classVarDec")
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.KEYWORD:
             raise ValueError(f"trying to compile class but keyword not found")
-        if self._tokenizer.keyword() not in [KeyWord.STATIC, KeyWord.FIELD]:
+        if self._tokenizer.keyword() not in CompilationEngine.CLASS_VAR_KEYWORDS:
             raise ValueError(f"keyword for class var should be either static or field")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
-        if token_type == TokenType.KEYWORD and self._tokenizer.keyword() not in [
-            KeyWord.INT,
-            KeyWord.BOOLEAN,
-            KeyWord.CHAR,
-        ]:
+        if (
+            token_type == TokenType.KEYWORD
+            and self._tokenizer.keyword() not in CompilationEngine.TYPE_KEYWORDS
+        ):
             raise ValueError(
                 f"type for class var should be one of [int, boolean, char]"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
@@ -325,7 +1205,7 @@ class CompilationEngine:
             raise ValueError(
                 "trying to compile a class var but could not find an identifier"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         while not (
@@ -337,7 +1217,7 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile class but could not find symbol ','"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
@@ -345,48 +1225,39 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a class var but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             raise ValueError("trying to compile class but could not find symbol ';'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</classVarDec>\n")
+        self._builder.end("classVarDec")
 
     def compile_subroutine(self):
-        self._outfile.write("<subroutineDec>\n")
+        self._builder.begin("subroutineDec")
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.KEYWORD:
             raise ValueError(
                 "trying to compile class subroutine but could not find a keyword"
             )
-        if self._tokenizer.keyword() not in [
-            KeyWord.CONSTRUCTOR,
-            KeyWord.FUNCTION,
-            KeyWord.METHOD,
-        ]:
+        if self._tokenizer.keyword() not in CompilationEngine.SUBROUTINE_KEYWORDS:
             raise ValueError(
                 f"type for class subroutine should be one of [constructor, function, method]"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type == TokenType.KEYWORD:
-            if self._tokenizer.keyword() not in [
-                KeyWord.VOID,
-                KeyWord.INT,
-                KeyWord.BOOLEAN,
-                KeyWord.CHAR,
-            ]:
+            if self._tokenizer.keyword() not in CompilationEngine.RETURN_TYPE_KEYWORDS:
                 raise ValueError(
                     f"type for class subroutine should be one of [void, int, boolean, char]"
                 )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
@@ -394,7 +1265,7 @@ class CompilationEngine:
             raise ValueError(
                 "trying to compile a class subroutine but could not find an identifier"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
@@ -402,7 +1273,7 @@ class CompilationEngine:
             raise ValueError("trying to compile class but could not find symbol '('")
         if self._tokenizer.symbol() != "(":
             raise ValueError("trying to compile class but could not find symbol '('")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_parameter_list()
@@ -412,32 +1283,29 @@ class CompilationEngine:
             raise ValueError("trying to compile class but could not find symbol ')'")
         if self._tokenizer.symbol() != ")":
             raise ValueError("trying to compile class but could not find symbol ')'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_subroutine_body()
 
-        self._outfile.write("</subroutineDec>\n")
+        self._builder.end("subroutineDec")
 
     def compile_parameter_list(self):
-        self._outfile.write("<parameterList>\n")
+        self._builder.begin("parameterList")
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             token_type = self._tokenizer.token_type()
-            if token_type != TokenType.KEYWORD:
-                raise ValueError(
-                    "trying to compile parameter list but could not find a keyword"
-                )
-            if self._tokenizer.keyword() not in [
-                KeyWord.INT,
-                KeyWord.BOOLEAN,
-                KeyWord.CHAR,
-            ]:
+            if token_type == TokenType.KEYWORD:
+                if self._tokenizer.keyword() not in CompilationEngine.TYPE_KEYWORDS:
+                    raise ValueError(
+                        f"type for parameter list should be one of [int, boolean, char]"
+                    )
+            elif token_type != TokenType.IDENTIFIER:
                 raise ValueError(
-                    f"type for parameter list should be one of [int, boolean, char]"
+                    "trying to compile parameter list but could not find a type"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
@@ -445,7 +1313,7 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a var dec but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         while not (
@@ -457,23 +1325,20 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile parameter list but could not find symbol ','"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
-            if token_type != TokenType.KEYWORD:
+            if token_type == TokenType.KEYWORD:
+                if self._tokenizer.keyword() not in CompilationEngine.TYPE_KEYWORDS:
+                    raise ValueError(
+                        f"type for parameter list should be one of [int, boolean, char]"
+                    )
+            elif token_type != TokenType.IDENTIFIER:
                 raise ValueError(
-                    "trying to compile parameter list but could not find a keyword"
+                    "trying to compile parameter list but could not find a type"
                 )
-            if self._tokenizer.keyword() not in [
-                KeyWord.INT,
-                KeyWord.BOOLEAN,
-                KeyWord.CHAR,
-            ]:
-                raise ValueError(
-                    f"type for parameter list should be one of [int, boolean, char]"
-                )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
@@ -481,20 +1346,20 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a var dec but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
-        self._outfile.write("</parameterList>\n")
+        self._builder.end("parameterList")
 
     def compile_subroutine_body(self):
-        self._outfile.write("<subroutineBody>\n")
+        self._builder.begin("subroutineBody")
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             raise ValueError("trying to compile class but could not find symbol '{'")
         if self._tokenizer.symbol() != "{":
             raise ValueError("trying to compile class but could not find symbol '{'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         while (
@@ -510,36 +1375,32 @@ class CompilationEngine:
             raise ValueError("trying to compile class but could not find symbol '}'")
         if self._tokenizer.symbol() != "}":
             raise ValueError("trying to compile class but could not find symbol '}'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</subroutineBody>\n")
+        self._builder.end("subroutineBody")
 
     def compile_var_dec(self):
-        self._outfile.write("<varDec>\n")
+        self._builder.begin("varDec")
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.KEYWORD:
             raise ValueError("trying to compile var dec but could not find keyword var")
         if self._tokenizer.keyword() != KeyWord.VAR:
             raise ValueError("trying to compile var dec but could not find keywrod var")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type == TokenType.KEYWORD:
-            if self._tokenizer.keyword() not in [
-                KeyWord.INT,
-                KeyWord.BOOLEAN,
-                KeyWord.CHAR,
-            ]:
+            if self._tokenizer.keyword() not in CompilationEngine.TYPE_KEYWORDS:
                 raise ValueError(
                     f"type for var dec should be one of [int, boolean, char]"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
         elif token_type == TokenType.IDENTIFIER:
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
@@ -547,7 +1408,7 @@ class CompilationEngine:
             raise ValueError(
                 "trying to compile a var dec but could not find an identifier"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         while not (
@@ -559,7 +1420,7 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile var dec but could not find symbol ','"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
@@ -567,48 +1428,33 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a var dec but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if token_type != TokenType.SYMBOL:
             raise ValueError("trying to compile class but could not find symbol ';'")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</varDec>\n")
+        self._builder.end("varDec")
 
     def compile_statements(self):
-        self._outfile.write("<statements>\n")
+        self._builder.begin("statements")
 
         while self._tokenizer.token_type() == TokenType.KEYWORD:
-            keyword = self._tokenizer.keyword()
-            if keyword not in [
-                KeyWord.LET,
-                KeyWord.IF,
-                KeyWord.WHILE,
-                KeyWord.DO,
-                KeyWord.RETURN,
-            ]:
+            compile_statement = self._statement_dispatch.get(self._tokenizer.keyword())
+            if compile_statement is None:
                 raise ValueError("Could not find statement keyword")
-            if keyword == KeyWord.LET:
-                self.compile_let()
-            if keyword == KeyWord.IF:
-                self.compile_if()
-            if keyword == KeyWord.WHILE:
-                self.compile_while()
-            if keyword == KeyWord.DO:
-                self.compile_do()
-            if keyword == KeyWord.RETURN:
-                self.compile_return()
-        self._outfile.write("</statements>\n")
+            compile_statement()
+        self._builder.end("statements")
 
     def compile_let(self):
-        self._outfile.write("<letStatement>\n")
+        self._builder.begin("letStatement")
         keyword = self._tokenizer.keyword()
         if keyword != KeyWord.LET:
             raise ValueError("Keyword is not let")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
@@ -616,26 +1462,26 @@ class CompilationEngine:
             raise ValueError(
                 "trying to compile a let statement but could not find an identifier"
             )
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         if not (token_type == TokenType.SYMBOL and self._tokenizer.symbol() == "="):
             if self._tokenizer.symbol() != "[":
                 raise ValueError("symbol [ not found")
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             self.compile_expression()
 
             if self._tokenizer.symbol() != "]":
                 raise ValueError("symbol ] not found")
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         if self._tokenizer.symbol() != "=":
             raise ValueError("symbol = not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_expression()
@@ -647,124 +1493,124 @@ class CompilationEngine:
             )
         if self._tokenizer.symbol() != ";":
             raise ValueError("symbol ; not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</letStatement>\n")
+        self._builder.end("letStatement")
 
     def compile_if(self):
-        self._outfile.write("<ifStatement>\n")
+        self._builder.begin("ifStatement")
 
         keyword = self._tokenizer.keyword()
         if keyword != KeyWord.IF:
             raise ValueError("Keyword is not if")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         if self._tokenizer.symbol() != "(":
             raise ValueError("symbol ( not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_expression()
 
         if self._tokenizer.symbol() != ")":
             raise ValueError("symbol ) not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         if self._tokenizer.symbol() != "{":
             raise ValueError("symbol { not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_statements()
 
         if self._tokenizer.symbol() != "}":
             raise ValueError("symbol } not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
         keyword = self._tokenizer.keyword()
         if token_type == TokenType.KEYWORD and keyword == KeyWord.ELSE:
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             if self._tokenizer.symbol() != "{":
                 raise ValueError("symbol { not found")
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             self.compile_statements()
 
             if self._tokenizer.symbol() != "}":
                 raise ValueError("symbol } not found")
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
-        self._outfile.write("</ifStatement>\n")
+        self._builder.end("ifStatement")
 
     def compile_while(self):
-        self._outfile.write("<whileStatement>\n")
+        self._builder.begin("whileStatement")
 
         keyword = self._tokenizer.keyword()
         if keyword != KeyWord.WHILE:
             raise ValueError("Keyword is not while")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         if self._tokenizer.symbol() != "(":
             raise ValueError("symbol ( not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_expression()
 
         if self._tokenizer.symbol() != ")":
             raise ValueError("symbol ) not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         if self._tokenizer.symbol() != "{":
             raise ValueError("symbol { not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_statements()
 
         if self._tokenizer.symbol() != "}":
             raise ValueError("symbol } not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</whileStatement>\n")
+        self._builder.end("whileStatement")
 
     def compile_do(self):
-        self._outfile.write("<doStatement>\n")
+        self._builder.begin("doStatement")
 
         keyword = self._tokenizer.keyword()
         if keyword != KeyWord.DO:
             raise ValueError("Keyword is not do")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         self.compile_subroutine_call()
 
         if self._tokenizer.symbol() != ";":
             raise ValueError("symbol ; not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</doStatement>\n")
+        self._builder.end("doStatement")
 
     def compile_return(self):
-        self._outfile.write("<returnStatement>\n")
+        self._builder.begin("returnStatement")
 
         keyword = self._tokenizer.keyword()
         if keyword != KeyWord.RETURN:
             raise ValueError("Keyword is not return")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
         if self._tokenizer.symbol() != ";":
@@ -772,10 +1618,10 @@ class CompilationEngine:
 
         if self._tokenizer.symbol() != ";":
             raise ValueError("symbol ; not found")
-        self._tokenizer.write_token(self._outfile)
+        self._write_token()
         self._tokenizer.advance()
 
-        self._outfile.write("</returnStatement>\n")
+        self._builder.end("returnStatement")
 
     def compile_subroutine_call(self, term=False):
         if not term:
@@ -784,13 +1630,13 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a subroutine call but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         token_type = self._tokenizer.token_type()
 
         if self._tokenizer.symbol() == ".":
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             token_type = self._tokenizer.token_type()
@@ -798,18 +1644,18 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile a subroutine call but could not find an identifier"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
         if self._tokenizer.symbol() == "(":
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             self.compile_expression_list()
 
             if self._tokenizer.symbol() != ")":
                 raise ValueError("symbol ) not found")
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
         else:
             raise ValueError(
@@ -817,72 +1663,144 @@ class CompilationEngine:
             )
 
     def compile_expression(self):
-        self._outfile.write("<expression>\n")
+        self._parse_expression(self._begin_expression)
 
-        self.compile_term()
-
-        while self._tokenizer.symbol() in ["+", "-", "*", "/", "&", "|", "<", ">", "="]:
-            self._tokenizer.write_token(self._outfile)
+    def compile_term(self):
+        self._parse_expression(self._begin_term)
+
+    def _parse_expression(self, step):
+        # Expressions nest through parentheses, unary operators, array
+        # indices and call arguments. Instead of recursing, each step returns
+        # the next one and pushes what has to happen once the nested part is
+        # done, so deep nesting is bounded by memory, not the call stack.
+        # Jack operators share a single precedence and group left to right.
+        stack = [None]
+        while step is not None:
+            step = step(stack)
+
+    def _begin_expression(self, stack):
+        self._builder.begin("expression")
+        stack.append(self._continue_expression)
+        return self._begin_term
+
+    def _continue_expression(self, stack):
+        if self._tokenizer.symbol() in CompilationEngine.BINARY_OPERATORS:
+            self._write_token()
             self._tokenizer.advance()
+            stack.append(self._continue_expression)
+            return self._begin_term
+        self._builder.end("expression")
+        return stack.pop()
 
-            self.compile_term()
-
-        self._outfile.write("</expression>\n")
-
-    def compile_term(self):
-        self._outfile.write("<term>\n")
+    def _begin_term(self, stack):
+        self._builder.begin("term")
         token_type = self._tokenizer.token_type()
         if token_type == TokenType.SYMBOL:
             symbol = self._tokenizer.symbol()
-            if symbol in ["-", "~"]:
-                self._tokenizer.write_token(self._outfile)
+            if symbol in CompilationEngine.UNARY_OPERATORS:
+                self._write_token()
                 self._tokenizer.advance()
-                self.compile_term()
+                stack.append(self._end_term)
+                return self._begin_term
             if symbol == "(":
-                self._tokenizer.write_token(self._outfile)
-                self._tokenizer.advance()
-
-                self.compile_expression()
-
-                self._tokenizer.write_token(self._outfile)
+                self._write_token()
                 self._tokenizer.advance()
+                stack.append(self._close_parenthesis)
+                return self._begin_expression
 
         if token_type == TokenType.IDENTIFIER:
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
-            token_type = self._tokenizer.token_type()
-            if token_type == TokenType.SYMBOL:
+            if self._tokenizer.token_type() == TokenType.SYMBOL:
                 symbol = self._tokenizer.symbol()
                 if symbol == "[":
-                    self._tokenizer.write_token(self._outfile)
+                    self._write_token()
                     self._tokenizer.advance()
+                    stack.append(self._close_bracket)
+                    return self._begin_expression
+                if symbol == "(" or symbol == ".":
+                    return self._begin_call
 
-                    self.compile_expression()
-
-                    self._tokenizer.write_token(self._outfile)
-                    self._tokenizer.advance()
-
-                if symbol in ["(", "."]:
-                    self.compile_subroutine_call(term=True)
-
-        if token_type in [TokenType.INT_CONST, TokenType.STRING_CONST]:
-            self._tokenizer.write_token(self._outfile)
+        if token_type in CompilationEngine.CONSTANT_TOKEN_TYPES:
+            self._write_token()
             self._tokenizer.advance()
 
         if token_type == TokenType.KEYWORD:
             keyword = self._tokenizer.keyword()
-            if keyword in [KeyWord.TRUE, KeyWord.FALSE, KeyWord.NULL, KeyWord.THIS]:
-                self._tokenizer.write_token(self._outfile)
+            if keyword in CompilationEngine.KEYWORD_CONSTANTS:
+                self._write_token()
                 self._tokenizer.advance()
 
-        self._outfile.write("</term>\n")
+        return self._end_term
+
+    def _end_term(self, stack):
+        self._builder.end("term")
+        return stack.pop()
+
+    def _close_parenthesis(self, stack):
+        if self._tokenizer.symbol() != ")":
+            raise ValueError("symbol ) not found")
+        self._write_token()
+        self._tokenizer.advance()
+        return self._end_term
+
+    def _close_bracket(self, stack):
+        if self._tokenizer.symbol() != "]":
+            raise ValueError("symbol ] not found")
+        self._write_token()
+        self._tokenizer.advance()
+        return self._end_term
+
+    def _begin_call(self, stack):
+        if self._tokenizer.symbol() == ".":
+            self._write_token()
+            self._tokenizer.advance()
+
+            if self._tokenizer.token_type() != TokenType.IDENTIFIER:
+                raise ValueError(
+                    "trying to compile a subroutine call but could not find an identifier"
+                )
+            self._write_token()
+            self._tokenizer.advance()
+
+        if self._tokenizer.symbol() != "(":
+            raise ValueError(
+                "trying to compile a subroutine call but could not find '(' symbol."
+            )
+        self._write_token()
+        self._tokenizer.advance()
+
+        self._builder.begin("expressionList")
+        if self._tokenizer.symbol() == ")":
+            return self._end_call
+        stack.append(self._continue_arguments)
+        return self._begin_expression
+
+    def _continue_arguments(self, stack):
+        if self._tokenizer.symbol() == ")":
+            return self._end_call
+        token_type = self._tokenizer.token_type()
+        if token_type != TokenType.SYMBOL or self._tokenizer.symbol() != ",":
+            raise ValueError(
+                "trying to compile expression list but could not find symbol ','"
+            )
+        self._write_token()
+        self._tokenizer.advance()
+        stack.append(self._continue_arguments)
+        return self._begin_expression
+
+    def _end_call(self, stack):
+        self._builder.end("expressionList")
+        self._write_token()
+        self._tokenizer.advance()
+        return self._end_term
 
     def compile_expression_list(self):
-        self._outfile.write("<expressionList>\n")
+        self._builder.begin("expressionList")
 
         if self._tokenizer.symbol() == ")":
-            self._outfile.write("</expressionList>\n")
+            self._builder.end("expressionList")
             return
         self.compile_expression()
 
@@ -892,46 +1810,466 @@ class CompilationEngine:
                 raise ValueError(
                     "trying to compile expression list but could not find symbol ','"
                 )
-            self._tokenizer.write_token(self._outfile)
+            self._write_token()
             self._tokenizer.advance()
 
             self.compile_expression()
 
-        self._outfile.write("</expressionList>\n")
+        self._builder.end("expressionList")
+
+
+def output_files(source: pathlib.Path, formats):
+    outputs = [source.with_name(source.stem + "T-new").with_suffix(".xml")]
+    for output_format in formats:
+        # VM code is named after the class, so a directory of compiled classes
+        # is a program for the VM translator
+        stem = source.stem if output_format == "vm" else source.stem + "-new"
+        outputs.append(source.with_name(stem).with_suffix(f".{output_format}"))
+    return outputs
+
+
+def _string_constants(source: pathlib.Path, text=None):
+    # Class name, number of declared statics and distinct string constants in
+    # order of first use, which is the order VmBackend assigns them to statics
+    # after the declared ones
+    with JackTokenizer(source, text) as tokenizer:
+        tokenizer.advance()
+        tokenizer.advance()
+        class_name = tokenizer.identifier()
+        num_statics = 0
+        in_static_dec = False
+        strings = {}
+        while tokenizer.has_more_tokens():
+            tokenizer.advance()
+            token_type = tokenizer.token_type()
+            if token_type == TokenType.STRING_CONST:
+                strings.setdefault(tokenizer.string_val(), len(strings))
+            elif token_type == TokenType.KEYWORD:
+                if tokenizer.keyword() == KeyWord.STATIC:
+                    # static type name (, name)* ;
+                    in_static_dec = True
+                    num_statics += 1
+            elif in_static_dec and token_type == TokenType.SYMBOL:
+                if tokenizer.symbol() == ",":
+                    num_statics += 1
+                elif tokenizer.symbol() == ";":
+                    in_static_dec = False
+    return class_name, num_statics, list(strings)
+
+
+def string_pool(sources, texts=None):
+    # StringPool.init builds each distinct string of the program into a
+    # static of its own, then hands every class the strings it uses. texts
+    # maps a source to its content when that is in memory already.
+    if texts is None:
+        texts = {}
+    with tracing.span("string pool"):
+        classes = [_string_constants(source, texts.get(source)) for source in sources]
+    pool = {}
+    for _, _, strings in classes:
+        for value in strings:
+            pool.setdefault(value, len(pool))
+    # Every pooled string takes a static in the pool and one in each class
+    # that uses it, and the VM translator gives all of them a word in the
+    # Hack static segment
+    num_statics = len(pool) + sum(
+        class_statics + len(strings) for _, class_statics, strings in classes
+    )
+    available = STATIC_SEGMENT_SIZE - TRANSLATOR_VARIABLES
+    if num_statics > available:
+        raise ValueError(
+            f"pooled strings need {num_statics} statics but the static segment "
+            f"has room for {available}"
+        )
+
+    writer = VMWriter()
+    writer.write_function(f"{STRING_POOL}.init", 0)
+    for value, index in pool.items():
+        _write_string_constant(writer, value)
+        writer.write_pop("static", index)
+    for class_name, _, strings in classes:
+        if len(strings) == 0:
+            continue
+        for value in strings:
+            writer.write_push("static", pool[value])
+        writer.write_call(f"{class_name}.$strings", len(strings))
+        writer.write_pop("temp", 0)
+    writer.write_constant(0)
+    writer.write_return()
+    return writer.commands()
+
+
+def write_string_pool(sources, pool_file: pathlib.Path, texts=None):
+    commands = string_pool(sources, texts)
+    with open(pool_file, "w") as outfile:
+        outfile.write("".join(f"{command}\n" for command in commands))
+
+
+def compile_vm(source: pathlib.Path, pool_strings=False, text=None):
+    # Parses a class and returns its VM commands without writing any file.
+    # Given text, that is compiled instead of what the source file holds.
+    with tracing.span("compile_vm", file=source.name):
+        with JackTokenizer(source, text) as tokenizer:
+            tokenizer.advance()
+            tree = CompilationEngine(tokenizer=tokenizer).compile()
+        with tracing.span("vm"):
+            commands = VmBackend(pool_strings=pool_strings).compile(tree)
+    return commands
+
+
+class _TokenXmlTokenizer(StreamingJackTokenizer):
+    # Writes each token to the token XML as the parser advances past it, so
+    # one pass over the source serves both outputs
+    def __init__(self, source, token_xml_file):
+        super().__init__(source)
+        self._token_xml_file = token_xml_file
+        self._emitter = XmlEmitter()
+        self._count = 0
 
+    def open(self):
+        super().open()
+        self._emitter.begin("tokens")
 
-def compile(args):
-    source_path = pathlib.Path(args.source)
+    def advance(self):
+        super().advance()
+        if self._current_token_type is None:
+            return
+        self._emitter.token(self._current_token_type, self._current_token)
+        self._count += 1
+        if self._count % XmlStreamBuilder.FLUSH_TOKENS == 0:
+            self._emitter.write(self._token_xml_file)
+
+    def finish(self):
+        # Tokens after the class, which the parser never asks for
+        while self.has_more_tokens():
+            self.advance()
+        self._emitter.end("tokens")
+        self._emitter.write(self._token_xml_file)
+        tracing.count("tokens", self._count)
+
+
+def _analyze_streaming(source: pathlib.Path, token_xml, xml_file=None):
+    # Tokenizes in chunks. Given xml_file, the parse is written straight to
+    # it and no tree is built; otherwise the tree is returned for the other
+    # backends, and memory grows with it.
+    with open(token_xml, "w") as token_xml_file, _TokenXmlTokenizer(
+        source, token_xml_file
+    ) as tokenizer:
+        tokenizer.advance()
+        if xml_file is None:
+            tree = CompilationEngine(tokenizer=tokenizer).compile()
+        else:
+            with tracing.span("xml"), open(xml_file, "w") as outfile:
+                builder = XmlStreamBuilder(outfile)
+                tree = CompilationEngine(tokenizer=tokenizer, builder=builder).compile()
+        tokenizer.finish()
+    return tree
+
+
+def analyze(source: pathlib.Path, formats, stream=False, pool_strings=False, text=None):
+    # Given text, that is analyzed instead of what the source file holds. It
+    # is in memory already, so it is not streamed.
+    with tracing.span("analyze", file=source.name):
+        token_xml, *compile_files = output_files(source, formats)
+        stream = stream and text is None
+        if stream and set(formats) == {"xml"}:
+            _analyze_streaming(source, token_xml, compile_files[0])
+            return
+        if stream:
+            tree = _analyze_streaming(source, token_xml)
+        elif formats == ["xml"]:
+            _analyze_in_memory(source, token_xml, compile_files[0], text)
+            return
+        else:
+            tree = _analyze_in_memory(source, token_xml, text=text)
+
+        # Every backend walks the same parse tree
+        for output_format, compile_file in zip(formats, compile_files):
+            if output_format == "vm":
+                backend = VmBackend(pool_strings=pool_strings)
+            else:
+                backend = BACKENDS[output_format]()
+            with tracing.span(output_format), open(compile_file, "w") as outfile:
+                backend.write(tree, outfile)
+
+
+def _analyze_in_memory(source: pathlib.Path, token_xml, xml_file=None, text=None):
+    with JackTokenizer(source, text) as tokenizer:
+        emitter = XmlEmitter()
+        emitter.begin("tokens")
+        emitter.tokens(tokenizer.tokens())
+        emitter.end("tokens")
+        with open(token_xml, "w") as token_xml_file:
+            emitter.write(token_xml_file)
+
+        tokenizer.rewind()
+        tokenizer.advance()
+        if xml_file is None:
+            return CompilationEngine(tokenizer=tokenizer).compile()
+        with tracing.span("xml"), open(xml_file, "w") as outfile:
+            builder = XmlStreamBuilder(outfile)
+            return CompilationEngine(tokenizer=tokenizer, builder=builder).compile()
+
+
+class AnalysisCache:
+    # Outputs of previous runs, stored under a hash of the source, the
+    # requested formats and this analyzer's own code. Entries are directories
+    # whose modification time records the last use for LRU eviction.
+    VERSION = hashlib.sha256(pathlib.Path(__file__).read_bytes()).hexdigest()
+    STALE_PARTIAL_SECONDS = 3600
+
+    def __init__(self, cache_dir: pathlib.Path, max_entries=1000):
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(text, formats, pool_strings=False):
+        digest = hashlib.sha256(AnalysisCache.VERSION.encode())
+        digest.update(",".join(formats).encode())
+        if pool_strings:
+            digest.update(b"pool-strings")
+        digest.update(text.encode())
+        return digest.hexdigest()
+
+    def restore(self, key, outputs):
+        entry = self._cache_dir / key
+        if not entry.is_dir():
+            self.misses += 1
+            return False
+        for i, output in enumerate(outputs):
+            shutil.copyfile(entry / str(i), output)
+        os.utime(entry)
+        self.hits += 1
+        return True
+
+    def store(self, key, outputs):
+        entry = self._cache_dir / key
+        partial = self._cache_dir / f"{key}.{os.getpid()}.tmp"
+        partial.mkdir(exist_ok=True)
+        for i, output in enumerate(outputs):
+            shutil.copyfile(output, partial / str(i))
+        if entry.exists():
+            shutil.rmtree(partial)
+        else:
+            partial.rename(entry)
+        self._evict()
+
+    def report(self):
+        print(
+            f"cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions"
+        )
+
+    def _evict(self):
+        entries = []
+        now = time.time()
+        for entry in self._cache_dir.iterdir():
+            if entry.suffix == ".tmp":
+                # Another process may still be writing a partial entry, so
+                # only those left behind by a run that died are removed
+                try:
+                    age = now - entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age > AnalysisCache.STALE_PARTIAL_SECONDS:
+                    shutil.rmtree(entry, ignore_errors=True)
+            elif entry.is_dir():
+                entries.append(entry)
+        if len(entries) <= self._max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[: len(entries) - self._max_entries]:
+            shutil.rmtree(entry, ignore_errors=True)
+            self.evictions += 1
+
+
+class MemoryCache:
+    # Keeps outputs in memory for --watch, in front of an optional cache on
+    # disk, so a run after an edit analyzes only the classes whose content
+    # changed and writes the outputs of the others from memory
+    def __init__(self, backing: AnalysisCache = None):
+        self._outputs = {}
+        self._backing = backing
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, formats, pool_strings=False):
+        return AnalysisCache.key(text, formats, pool_strings)
+
+    def restore(self, key, outputs):
+        contents = self._outputs.get(key)
+        if contents is None:
+            if self._backing is None or not self._backing.restore(key, outputs):
+                self.misses += 1
+                return False
+            contents = [output.read_text() for output in outputs]
+            self._outputs[key] = contents
+        for output, content in zip(outputs, contents):
+            output.write_text(content)
+        self.hits += 1
+        return True
+
+    def store(self, key, outputs):
+        self._outputs[key] = [output.read_text() for output in outputs]
+        if self._backing is not None:
+            self._backing.store(key, outputs)
+
+    def report(self):
+        print(f"cache: {self.hits} hits, {self.misses} misses")
+
+
+def _read_source(source: pathlib.Path):
+    with open(source, "r", encoding="UTF-8") as f:
+        return f.read()
+
+
+def _analyze_file(
+    source: pathlib.Path, formats, stream=False, pool_strings=False, text=None
+):
+    # Reports the error instead of raising so that one broken class does not
+    # abort the other files, in or out of a worker process
+    try:
+        analyze(source, formats, stream, pool_strings, text)
+    except Exception as e:
+        return source, f"{type(e).__name__}: {e}"
+    return source, None
+
+
+def _analyze_in_worker(source, formats, stream, pool_strings, text, trace):
+    # Runs in a worker process. With trace, it records to a tracer of its own
+    # and returns the spans and counters for the parent to merge, as any
+    # tracer inherited from the parent is a copy that never gets written.
+    if not trace:
+        return _analyze_file(source, formats, stream, pool_strings, text), [], {}
+    tracer = tracing.start()
+    try:
+        result = _analyze_file(source, formats, stream, pool_strings, text)
+    finally:
+        tracing.stop()
+    return result, tracer.roots, tracer.counters
+
+
+def _jack_sources(source_path: pathlib.Path):
     sources = list(source_path.iterdir()) if source_path.is_dir() else [source_path]
+    return sorted(source for source in sources if source.suffix == ".jack")
+
+
+def _disk_cache(args):
+    if args.cache is None:
+        return None
+    return AnalysisCache(pathlib.Path(args.cache), args.cache_size)
+
+
+def compile(args, cache=None):
+    sources = _jack_sources(pathlib.Path(args.source))
+
+    if cache is None:
+        cache = _disk_cache(args)
+    keys = {}
+    texts = {}
+    cached = set()
+    if cache is not None:
+        # Each class is analyzed from the text its key was made of, so a save
+        # in between cannot store the outputs of one version under another
+        for source in sources:
+            texts[source] = _read_source(source)
+            keys[source] = cache.key(texts[source], args.format, args.pool_strings)
+            if cache.restore(keys[source], output_files(source, args.format)):
+                cached.add(source)
+    pending = [source for source in sources if source not in cached]
+    pending_texts = [texts.get(source) for source in pending]
+
+    if args.jobs > 1 and len(pending) > 1:
+        trace = args.trace is not None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = []
+            for result, spans, counters in pool.map(
+                _analyze_in_worker,
+                pending,
+                [args.format] * len(pending),
+                [args.stream] * len(pending),
+                [args.pool_strings] * len(pending),
+                pending_texts,
+                [trace] * len(pending),
+            ):
+                results.append(result)
+                tracing.merge(spans, counters)
+    else:
+        results = [
+            _analyze_file(source, args.format, args.stream, args.pool_strings, text)
+            for source, text in zip(pending, pending_texts)
+        ]
+    results = dict(results)
 
+    failures = 0
     for source in sources:
-        if source.suffix != ".jack":
-            continue
-        token_xml = source.with_name(source.stem + "T-new").with_suffix(".xml")
-        print(f"Token xml -> {token_xml}")
-        with JackTokenizer(source) as tokenizer, open(token_xml, "w") as token_xml_file:
-            token_xml_file.write("<tokens>\n")
-            while tokenizer.has_more_tokens():
-                tokenizer.advance()
-                tokenizer.write_token(token_xml_file)
-            token_xml_file.write("</tokens>\n")
-
-        compile_xml = source.with_name(source.stem + "-new").with_suffix(".xml")
-        with JackTokenizer(source) as tokenizer, open(
-            compile_xml, "w"
-        ) as compile_xml_file:
-            tokenizer.advance()
-            engine = CompilationEngine(tokenizer=tokenizer, outfile=compile_xml_file)
-            engine.compile()
+        error = results.get(source)
+        if source in cached:
+            print(f"{source}: cached")
+        elif error is None:
+            if cache is not None:
+                cache.store(keys[source], output_files(source, args.format))
+            print(f"{source}: ok")
+        else:
+            print(f"{source}: failed: {error}")
+            failures += 1
+    if args.pool_strings and "vm" in args.format and failures == 0:
+        pool_file = sources[0].with_name(STRING_POOL).with_suffix(".vm")
+        try:
+            write_string_pool(sources, pool_file, texts)
+            print(f"{pool_file}: ok")
+        except ValueError as e:
+            print(f"{pool_file}: failed: {type(e).__name__}: {e}")
+            failures += 1
+    if cache is not None:
+        cache.report()
+    return failures
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", type=str, default="project10/Square/Main.jack")
+    parser.add_argument(
+        "--format", type=str, action="append", choices=list(BACKENDS), default=None
+    )
+
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="tokenize in chunks and write XML without building a parse tree; "
+        "with json or vm output the tree is still built",
+    )
+    parser.add_argument("--cache", type=str, default=None)
+    parser.add_argument("--cache-size", type=int, default=1000)
+    parser.add_argument("--pool-strings", action="store_true")
+    watcher.add_arguments(parser)
+    tracing.add_arguments(parser)
 
     args = parser.parse_args()
-
-    compile(args)
+    if args.format is None:
+        args.format = ["xml"]
+
+    with tracing.traced(args.trace, args.trace_format):
+        if args.watch:
+            # Outputs stay in memory between runs, keyed by the content of
+            # the class, so only classes that changed are analyzed again
+            source_path = pathlib.Path(args.source)
+            cache = MemoryCache(_disk_cache(args))
+            watcher.watch(
+                source_path,
+                lambda: _jack_sources(source_path),
+                lambda: compile(args, cache),
+                args.interval,
+            )
+            return
+        failures = compile(args)
+    if failures != 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
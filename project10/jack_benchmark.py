@@ -0,0 +1,118 @@
+import argparse
+
+import json
+
+import pathlib
+
+import tempfile
+
+import time
+
+from jack_analyzer import CompilationEngine, JackTokenizer, XmlBackend
+
+
+def _subroutine(index, body_size):
+    lines = [f"    method int run{index}(int a, boolean flag, char c) {{"]
+    lines += ["        var int i, sum;", "        var Array values;"]
+    lines += ["        var String name;", "        let i = 0;", "        let sum = 0;"]
+    lines += ["        let values = Array.new(16);"]
+    for j in range(body_size):
+        lines += [f"        let sum = sum + (a * {j}) - (i / 2) & ~(c | {j});"]
+        lines += [f"        if ((sum < {j}) | (sum > a) & flag) {{"]
+        lines += [f"            let values[i + {j % 16}] = -sum;"]
+        lines += ["        } else {"]
+        lines += [f'            let name = "name {j}";']
+        lines += [f"            do Output.printString(name);"]
+        lines += ["        }"]
+        lines += ["        while (i < 10) {"]
+        lines += [f"            let i = i + values[{j % 16}];"]
+        lines += [f"            do run{index}(i, true, c);"]
+        lines += ["        }"]
+    lines += ["        return sum;", "    }"]
+    return lines
+
+
+def _large_class(name, num_subroutines, body_size):
+    lines = [f"class {name} {{", "    field int x, y;", "    static boolean flag;"]
+    lines += [f"    constructor {name} new() {{", "        return this;", "    }"]
+    for i in range(num_subroutines):
+        lines += _subroutine(i, body_size)
+    lines += ["}"]
+    return "\n".join(lines) + "\n"
+
+
+WORKLOADS = {
+    "large_class": lambda scale: _large_class("Large", 100 * scale, 20),
+    "many_subroutines": lambda scale: _large_class("Many", 2000 * scale, 1),
+}
+
+
+def run_workload(name, scale, repeat):
+    source = WORKLOADS[name](scale)
+    with tempfile.TemporaryDirectory() as work_dir:
+        jack_file = pathlib.Path(work_dir) / f"{name}.jack"
+        jack_file.write_text(source, encoding="UTF-8")
+        xml_file = pathlib.Path(work_dir) / f"{name}.xml"
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with JackTokenizer(jack_file) as tokenizer:
+                tokenize_end = time.perf_counter()
+                num_tokens = 0
+                while tokenizer.has_more_tokens():
+                    tokenizer.advance()
+                    num_tokens += 1
+                tokenizer.rewind()
+                parse_start = time.perf_counter()
+                tokenizer.advance()
+                tree = CompilationEngine(tokenizer=tokenizer).compile()
+                parse_end = time.perf_counter()
+            with open(xml_file, "w") as outfile:
+                XmlBackend().write(tree, outfile)
+            end = time.perf_counter()
+            times = (
+                tokenize_end - start,
+                parse_end - parse_start,
+                end - parse_end,
+            )
+            if best is None or times[1] < best[1]:
+                best = times
+        tokenize_time, parse_time, xml_time = best
+
+        return {
+            "tokens": num_tokens,
+            "tokenize_time": tokenize_time,
+            "parse_time": parse_time,
+            "xml_time": xml_time,
+            "tokens_per_second": num_tokens / parse_time,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workload", type=str, action="append", default=None)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=str, default=None)
+    args = parser.parse_args()
+
+    names = args.workload if args.workload is not None else list(WORKLOADS)
+    results = {}
+    for name in names:
+        result = run_workload(name, args.scale, args.repeat)
+        results[name] = result
+        print(
+            f"{name}: {result['tokens']} tokens, "
+            f"parsed at {result['tokens_per_second']:.0f} tokens/s "
+            f"(tokenize {result['tokenize_time']:.3f}s "
+            f"parse {result['parse_time']:.3f}s xml {result['xml_time']:.3f}s)"
+        )
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,20 @@ import argparse
 
 import pathlib
 
+import sys
+
 from enum import Enum
 
+# line_lexer.py, tracing.py and watcher.py at the repository root are shared
+# with the other tools
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+import tracing
+
+import watcher
+
+from line_lexer import is_stream, lex_commands
+
 
 class SymbolTable:
     def __init__(self):
@@ -29,65 +41,76 @@ class SymbolTable:
 
 
 class Code:
+    DEST = {
+        "M": "001",
+        "D": "010",
+        "MD": "011",
+        "A": "100",
+        "AM": "101",
+        "AD": "110",
+        "AMD": "111",
+    }
+    COMP = {
+        "0": "0101010",
+        "1": "0111111",
+        "-1": "0111010",
+        "D": "0001100",
+        "A": "0110000",
+        "!D": "0001101",
+        "!A": "0110001",
+        "-D": "0001111",
+        "-A": "0110011",
+        "D+1": "0011111",
+        "A+1": "0110111",
+        "D-1": "0001110",
+        "A-1": "0110010",
+        "D+A": "0000010",
+        "D-A": "0010011",
+        "A-D": "0000111",
+        "D&A": "0000000",
+        "D|A": "0010101",
+        "M": "1110000",
+        "!M": "1110001",
+        "-M": "1110011",
+        "M+1": "1110111",
+        "M-1": "1110010",
+        "D+M": "1000010",
+        "D-M": "1010011",
+        "M-D": "1000111",
+        "D&M": "1000000",
+        "D|M": "1010101",
+        # Operands of + & | may come in either order, as in "A=A+D"
+        "A+D": "0000010",
+        "A&D": "0000000",
+        "A|D": "0010101",
+        "M+D": "1000010",
+        "M&D": "1000000",
+        "M|D": "1010101",
+    }
+    JUMP = {
+        "JGT": "001",
+        "JEQ": "010",
+        "JGE": "011",
+        "JLT": "100",
+        "JNE": "101",
+        "JLE": "110",
+        "JMP": "111",
+    }
+
     def __init__(self):
         pass
 
     def dest(self, mnemonic):
-        code = {
-            "M": "001",
-            "D": "010",
-            "MD": "011",
-            "A": "100",
-            "AM": "101",
-            "AD": "110",
-            "AMD": "111",
-        }
-        return code.get(mnemonic, "000")
+        return Code.DEST.get(mnemonic, "000")
 
     def comp(self, mnemonic):
-        code = {
-            "0": "0101010",
-            "1": "0111111",
-            "-1": "0111010",
-            "D": "0001100",
-            "A": "0110000",
-            "!D": "0001101",
-            "!A": "0110001",
-            "-D": "0001111",
-            "-A": "0110011",
-            "D+1": "0011111",
-            "A+1": "0110111",
-            "D-1": "0001110",
-            "A-1": "0110010",
-            "D+A": "0000010",
-            "D-A": "0010011",
-            "A-D": "0000111",
-            "D&A": "0000000",
-            "D|A": "0010101",
-            "M": "1110000",
-            "!M": "1110001",
-            "-M": "1110011",
-            "M+1": "1110111",
-            "M-1": "1110010",
-            "D+M": "1000010",
-            "D-M": "1010011",
-            "M-D": "1000111",
-            "D&M": "1000000",
-            "D|M": "1010101",
-        }
-        return code.get(mnemonic, "1111111")
+        code = Code.COMP.get(mnemonic)
+        if code is None:
+            raise ValueError(f"Unknown comp: {mnemonic}")
+        return code
 
     def jump(self, mnemonic):
-        code = {
-            "JGT": "001",
-            "JEQ": "010",
-            "JGE": "011",
-            "JLT": "100",
-            "JNE": "101",
-            "JLE": "110",
-            "JMP": "111",
-        }
-        return code.get(mnemonic, "000")
+        return Code.JUMP.get(mnemonic, "000")
 
 
 class CommandType(Enum):
@@ -119,19 +142,23 @@ class Parser:
         return "Unknown command"
 
     def open(self):
-        self._file = open(self._asm_file, "r", encoding="UTF-8")
-        self._next_command = self._retrieve_next_command()
+        if isinstance(self._asm_file, tuple):
+            # Commands that are lexed already, as assemble() hands them over.
+            # A list holds lines, which are lexed like those of a file.
+            self._commands = iter(self._asm_file)
+        else:
+            self._commands = iter(lex_commands(self._asm_file))
+        self._next_command = next(self._commands, None)
 
     def close(self):
-        if not self._file.closed:
-            self._file.close()
+        self._commands = None
 
     def has_more_commands(self):
         return self._next_command is not None
 
     def advance(self):
         self._current_command = self._next_command
-        self._next_command = self._retrieve_next_command()
+        self._next_command = next(self._commands, None)
 
     def command_type(self) -> CommandType:
         if self._current_command.startswith("(") and self._current_command.endswith(
@@ -173,81 +200,87 @@ class Parser:
         else:
             return self._current_command[sc_index + 1 :]
 
-    def _remove_comment(self, line: str):
-        command_index = line.find("//")
-        return line[:command_index]
-
-    def _remove_white_spaces(self, line: str):
-        return line.replace(" ", "")
-
-    def _retrieve_next_command(self):
-        command = self._file.readline()
-        while len(command) != 0:
-            command = self._remove_comment(command)
-            command = self._remove_white_spaces(command)
-            if len(command) != 0:
-                return command
-            else:
-                command = self._file.readline()
-        return None
-
 
-def assemble(asm_file: pathlib.Path):
-    symbol_table = SymbolTable()
-
-    address = 0
-    with Parser(asm_file) as parser:
-        while parser.has_more_commands():
-            parser.advance()
-            if parser.command_type() == CommandType.L_COMMAND:
-                symbol = parser.symbol()
-                symbol_table.add_entry(symbol, address)
-            else:
-                address += 1
-            print(f"{parser}")
-
-    next_ram_address = 16
-    code_generator = Code()
-    binary_code = None
-
-    code_list = []
-    with Parser(asm_file) as parser:
-        while parser.has_more_commands():
-            parser.advance()
-            if parser.command_type() == CommandType.L_COMMAND:
-                continue
-            elif parser.command_type() == CommandType.A_COMMAND:
-                symbol = parser.symbol()
-                try:
-                    value = int(symbol)
-                    binary_code = f"{value:016b}"
-                except:
-                    if not symbol_table.contains(symbol):
-                        ram_address = next_ram_address
-                        symbol_table.add_entry(symbol, ram_address)
-                        next_ram_address += 1
-                    else:
-                        ram_address = symbol_table.get_address(symbol)
-                    binary_code = f"{ram_address:016b}"
-            elif parser.command_type() == CommandType.C_COMMAND:
-                dest = code_generator.dest(parser.dest())
-                comp = code_generator.comp(parser.comp())
-                jump = code_generator.jump(parser.jump())
-                binary_code = f"111{comp}{dest}{jump}"
-            else:
-                raise NotImplementedError("Unknown command type")
-            code_list.append(binary_code)
-            print(f"code: {binary_code}")
-
-    hack_file = asm_file.with_suffix(".hack")
-    with open(hack_file, "w", encoding="UTF-8") as f:
-        for code in code_list:
-            f.write(code + "\n")
+def assemble(asm_file, hack_file=None, verbose=True):
+    # asm_file may be a path, an open stream or a list of lines in memory. The
+    # machine code is returned and written to hack_file, which defaults to
+    # the .hack next to a path.
+    if isinstance(asm_file, list):
+        name = "<lines>"
+    elif is_stream(asm_file):
+        name = "<stream>"
+    else:
+        name = asm_file.name
+        if hack_file is None:
+            hack_file = asm_file.with_suffix(".hack")
+    with tracing.span("assemble", file=name):
+        # Both passes read the program, so it is lexed once and kept
+        commands = tuple(lex_commands(asm_file))
+        symbol_table = SymbolTable()
+
+        address = 0
+        num_symbols = 0
+        with tracing.span("first pass"), Parser(commands) as parser:
+            while parser.has_more_commands():
+                parser.advance()
+                if parser.command_type() == CommandType.L_COMMAND:
+                    symbol = parser.symbol()
+                    symbol_table.add_entry(symbol, address)
+                    num_symbols += 1
+                else:
+                    address += 1
+                if verbose:
+                    print(f"{parser}")
+
+        next_ram_address = 16
+        code_generator = Code()
+        binary_code = None
+
+        code_list = []
+        with tracing.span("second pass"), Parser(commands) as parser:
+            while parser.has_more_commands():
+                parser.advance()
+                if parser.command_type() == CommandType.L_COMMAND:
+                    continue
+                elif parser.command_type() == CommandType.A_COMMAND:
+                    symbol = parser.symbol()
+                    try:
+                        value = int(symbol)
+                        binary_code = f"{value:016b}"
+                    except:
+                        if not symbol_table.contains(symbol):
+                            ram_address = next_ram_address
+                            symbol_table.add_entry(symbol, ram_address)
+                            next_ram_address += 1
+                            num_symbols += 1
+                        else:
+                            ram_address = symbol_table.get_address(symbol)
+                        binary_code = f"{ram_address:016b}"
+                elif parser.command_type() == CommandType.C_COMMAND:
+                    dest = code_generator.dest(parser.dest())
+                    comp = code_generator.comp(parser.comp())
+                    jump = code_generator.jump(parser.jump())
+                    binary_code = f"111{comp}{dest}{jump}"
+                else:
+                    raise NotImplementedError("Unknown command type")
+                code_list.append(binary_code)
+                if verbose:
+                    print(f"code: {binary_code}")
+        tracing.count("instructions", len(code_list))
+        tracing.count("asm_symbols", num_symbols)
+
+        if hack_file is not None:
+            with tracing.span("write"), open(hack_file, "w", encoding="UTF-8") as f:
+                for code in code_list:
+                    f.write(code + "\n")
+        return code_list
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--asm", type=str, required=True)
+    watcher.add_arguments(parser)
+    tracing.add_arguments(parser)
     args = parser.parse_args()
 
     asm_file = args.asm
@@ -256,7 +289,14 @@ def main():
             f"Given file is not an asm file: {asm_file}. Asm file should end with '.asm'"
         )
 
-    assemble(pathlib.Path(args.asm))
+    asm_file = pathlib.Path(args.asm)
+    with tracing.traced(args.trace, args.trace_format):
+        if args.watch:
+            watcher.watch(
+                asm_file, lambda: [asm_file], lambda: assemble(asm_file), args.interval
+            )
+        else:
+            assemble(asm_file)
 
 
 if __name__ == "__main__":
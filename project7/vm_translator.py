@@ -2,8 +2,15 @@ import pathlib
 
 import argparse
 
+import sys
+
 from enum import Enum
 
+# line_lexer.py at the repository root is shared with the assembler
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from line_lexer import lex_fields
+
 
 class CommandType(Enum):
     C_ARITHMETIC = 1
@@ -52,19 +59,18 @@ class Parser:
         return "Unknown command"
 
     def open(self):
-        self._file = open(self._vm_file, "r", encoding="UTF-8")
-        self._next_command = self._retrieve_next_command()
+        self._commands = iter(lex_fields(self._vm_file))
+        self._next_command = next(self._commands, None)
 
     def close(self):
-        if not self._file.closed:
-            self._file.close()
+        self._commands = None
 
     def has_more_commands(self):
         return self._next_command is not None
 
     def advance(self):
         self._current_command = self._next_command
-        self._next_command = self._retrieve_next_command()
+        self._next_command = next(self._commands, None)
 
     def command_type(self) -> CommandType:
         if self._current_command[0] in Parser.ARITHMETIC_COMMANDS:
@@ -84,21 +90,6 @@ class Parser:
     def arg2(self):
         return self._current_command[2]
 
-    def _remove_comment(self, line: str):
-        command_index = line.find("//")
-        return line[:command_index]
-
-    def _retrieve_next_command(self):
-        command = self._file.readline()
-        while len(command) != 0:
-            command = self._remove_comment(command)
-            command = [c for c in command.split(" ") if " " not in c and len(c) != 0]
-            if len(command) != 0:
-                return command
-            else:
-                command = self._file.readline()
-        return None
-
 
 class CodeWriter:
     def __init__(self, asm_file):
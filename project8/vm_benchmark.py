@@ -0,0 +1,227 @@
+import argparse
+
+import json
+
+import pathlib
+
+import sys
+
+import tempfile
+
+import time
+
+from vm_translator import TranslationStats, translate
+
+BASELINE_FILE = pathlib.Path(__file__).with_name("vm_benchmark_baseline.json")
+
+
+def _call_chain(depth):
+    # Sys.init -> Chain.f0 -> Chain.f1 -> ... -> Chain.f{depth - 1}
+    lines = ["function Sys.init 0", "push constant 1", "call Chain.f0 1"]
+    lines += ["label END", "goto END"]
+    sys_vm = "\n".join(lines) + "\n"
+
+    lines = []
+    for i in range(depth):
+        lines.append(f"function Chain.f{i} 2")
+        lines += ["push argument 0", "pop local 0", "push local 0", "push constant 1"]
+        lines += ["add", "pop local 1"]
+        if i + 1 < depth:
+            lines += ["push local 1", f"call Chain.f{i + 1} 1"]
+        else:
+            lines += ["push local 1"]
+        lines.append("return")
+    chain_vm = "\n".join(lines) + "\n"
+    return {"Sys.vm": sys_vm, "Chain.vm": chain_vm}
+
+
+def _arithmetic_loops(num_functions, body_size):
+    lines = ["function Sys.init 0", "push constant 10"]
+    lines += [f"call Loop.f0 1", "label END", "goto END"]
+    sys_vm = "\n".join(lines) + "\n"
+
+    operators = ["add", "sub", "and", "or", "eq", "gt", "lt"]
+    lines = []
+    for i in range(num_functions):
+        lines += [f"function Loop.f{i} 3", "label LOOP"]
+        for j in range(body_size):
+            lines += [f"push local {j % 3}", f"push constant {j}"]
+            lines += [operators[j % len(operators)], "neg", "not"]
+            lines.append(f"pop local {(j + 1) % 3}")
+        lines += ["push argument 0", "push constant 1", "sub", "pop argument 0"]
+        lines += ["push argument 0", "if-goto LOOP", "push local 0", "return"]
+    loop_vm = "\n".join(lines) + "\n"
+    return {"Sys.vm": sys_vm, "Loop.vm": loop_vm}
+
+
+def _many_files(num_files, functions_per_file):
+    lines = ["function Sys.init 0", "call Class0.f0 0", "label END", "goto END"]
+    sources = {"Sys.vm": "\n".join(lines) + "\n"}
+    for i in range(num_files):
+        lines = []
+        for j in range(functions_per_file):
+            lines += [f"function Class{i}.f{j} 1", "push static 0"]
+            lines += ["pop local 0", "push local 0", "pop static 0"]
+            lines += ["push pointer 0", "pop temp 1", "push constant 0"]
+            if i + 1 < num_files and j == 0:
+                lines += [f"call Class{i + 1}.f0 0", "pop temp 0"]
+            lines.append("return")
+        sources[f"Class{i}.vm"] = "\n".join(lines) + "\n"
+    return sources
+
+
+WORKLOADS = {
+    "call_chain": lambda scale: _call_chain(2000 * scale),
+    "arithmetic_loops": lambda scale: _arithmetic_loops(50 * scale, 100),
+    "many_files": lambda scale: _many_files(200 * scale, 20),
+}
+
+
+# Figures stored in the baseline. Commands per second depend on the machine,
+# so the baseline keeps throughput relative to calibrate() instead.
+BASELINE_KEYS = ("commands", "relative_throughput", "rom_size")
+
+
+def calibrate(repeat):
+    # Lines per second of a fixed pure-Python loop that splits, looks up and
+    # formats like the translator does. It runs on the same machine and
+    # interpreter as the workloads, so throughput relative to it carries over
+    # between machines far better than commands per second.
+    lines = [f"push local {i % 8}" for i in range(50000)]
+    segments = {"local": "LCL"}
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asm = []
+        for line in lines:
+            command, segment, index = line.split()
+            asm.append(f"@{segments[segment]}\nD=M\n@{index}\nA=D+A\n")
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / best
+
+
+def _rom_size(asm_file: pathlib.Path):
+    with open(asm_file, "r", encoding="UTF-8") as f:
+        return sum(1 for line in f if not line.startswith("("))
+
+
+def run_workload(name, scale, repeat):
+    sources = WORKLOADS[name](scale)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = pathlib.Path(work_dir)
+        vm_files = []
+        for file_name, source in sources.items():
+            vm_file = work_dir / file_name
+            vm_file.write_text(source, encoding="UTF-8")
+            vm_files.append(vm_file)
+        out_file = work_dir / "Out.asm"
+
+        best = None
+        for _ in range(repeat):
+            stats = TranslationStats()
+            start = time.perf_counter()
+            translate(out_file=out_file, vm_files=vm_files, stats=stats)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, stats)
+        elapsed, stats = best
+
+        return {
+            "files": stats.files,
+            "commands": stats.total_commands(),
+            "parse_time": stats.parse_time,
+            "emit_time": stats.emit_time,
+            "commands_per_second": stats.total_commands() / elapsed,
+            "rom_size": _rom_size(out_file),
+        }
+
+
+def compare(results, baseline, time_threshold, size_threshold):
+    # baseline holds the figures of one scale
+    failures = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result["commands"] != expected["commands"]:
+            failures.append(
+                f"{name}: workload changed from {expected['commands']} to "
+                f"{result['commands']} commands, update the baseline"
+            )
+            continue
+        throughput = result["relative_throughput"] / expected["relative_throughput"]
+        if throughput < 1.0 - time_threshold:
+            failures.append(
+                f"{name}: throughput regressed to {throughput:.0%} of baseline"
+            )
+        size = result["rom_size"] / expected["rom_size"]
+        if size > 1.0 + size_threshold:
+            failures.append(f"{name}: ROM size grew to {size:.0%} of baseline")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workload", type=str, action="append", default=None)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_FILE))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-threshold", type=float, default=0.3)
+    parser.add_argument("--size-threshold", type=float, default=0.0)
+    parser.add_argument("--json", type=str, default=None)
+    args = parser.parse_args()
+
+    names = args.workload if args.workload is not None else list(WORKLOADS)
+    calibration = calibrate(args.repeat)
+    print(f"calibration: {calibration:.0f} lines/s")
+    results = {}
+    for name in names:
+        result = run_workload(name, args.scale, args.repeat)
+        result["relative_throughput"] = result["commands_per_second"] / calibration
+        results[name] = result
+        print(
+            f"{name}: {result['commands']} commands in {result['files']} files, "
+            f"{result['commands_per_second']:.0f} commands/s "
+            f"({result['relative_throughput']:.3f} of calibration, "
+            f"parse {result['parse_time']:.3f}s emit {result['emit_time']:.3f}s), "
+            f"ROM {result['rom_size']}"
+        )
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+    # The workloads grow with the scale, so each scale has a baseline of its own
+    baseline_file = pathlib.Path(args.baseline)
+    baseline = {}
+    if baseline_file.exists():
+        baseline = json.loads(baseline_file.read_text(encoding="UTF-8"))
+    scale = f"scale {args.scale}"
+    if args.update_baseline:
+        figures = baseline.setdefault(scale, {})
+        for name, result in results.items():
+            figures[name] = {key: result[key] for key in BASELINE_KEYS}
+        with open(baseline_file, "w", encoding="UTF-8") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"baseline updated: {baseline_file} ({scale})")
+        return
+
+    if scale not in baseline:
+        print(f"no baseline for {scale} in {baseline_file}")
+        return
+    failures = compare(
+        results, baseline[scale], args.time_threshold, args.size_threshold
+    )
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if len(failures) != 0:
+        sys.exit(1)
+    print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+from typing import Sequence
+
+import pathlib
+
+import argparse
+
+import re
+
+from vm_translator import CommandType, Parser
+
+RAM_SIZE = 32768
+STATIC_BASE = 16
+SP, LCL, ARG, THIS, THAT = 0, 1, 2, 3, 4
+
+
+def _wrap(value):
+    return ((value + 32768) & 0xFFFF) - 32768
+
+
+class VMInterpreter:
+    SEGMENT_POINTERS = {"local": LCL, "argument": ARG, "this": THIS, "that": THAT}
+    FIXED_SEGMENTS = {"pointer": 3, "temp": 5}
+
+    def __init__(self, vm_files: Sequence[pathlib.Path]):
+        self.ram = [0] * RAM_SIZE
+        self.pc = 0
+        self.steps = 0
+        self._ops = []
+        self._functions = {}
+        self._function_of_pc = []
+        self._statics = {}
+        self._load(vm_files)
+        self._counts = None
+
+    def has_function(self, function_name):
+        return function_name in self._functions
+
+    def enter(self, function_name):
+        self.pc = self._functions[function_name]
+
+    def bootstrap(self):
+        # Same as CodeWriter.write_init: SP = 256, call Sys.init
+        self.ram[SP] = 256
+        self._push_frame(len(self._ops) - 1, 0)
+        self.enter("Sys.init")
+
+    def enable_profiling(self):
+        self._counts = [0] * len(self._ops)
+
+    def run(self, max_steps=None):
+        ops = self._ops
+        pc = self.pc
+        steps = 0
+        limit = -1 if max_steps is None else max_steps
+        counts = self._counts
+        if counts is None:
+            while pc >= 0 and steps != limit:
+                pc = ops[pc](pc)
+                steps += 1
+        else:
+            while pc >= 0 and steps != limit:
+                counts[pc] += 1
+                pc = ops[pc](pc)
+                steps += 1
+        self.pc = pc
+        self.steps += steps
+        return pc < 0
+
+    def profile(self):
+        if self._counts is None:
+            raise ValueError("profiling is not enabled")
+        functions = {}
+        for pc, count in enumerate(self._counts):
+            function_name = self._function_of_pc[pc]
+            if function_name is None or count == 0:
+                continue
+            calls, instructions = functions.get(function_name, (0, 0))
+            if pc == self._functions[function_name]:
+                calls += count
+            functions[function_name] = (calls, instructions + count)
+        return functions
+
+    def _push_frame(self, return_pc, num_args):
+        ram = self.ram
+        sp = ram[SP]
+        ram[sp] = return_pc
+        ram[sp + 1] = ram[LCL]
+        ram[sp + 2] = ram[ARG]
+        ram[sp + 3] = ram[THIS]
+        ram[sp + 4] = ram[THAT]
+        ram[ARG] = sp - num_args
+        ram[SP] = sp + 5
+        ram[LCL] = sp + 5
+
+    def _load(self, vm_files):
+        labels = {}
+        jumps = []
+        current_function = None
+        for vm_file in vm_files:
+            with Parser(vm_file) as parser:
+                while parser.has_more_commands():
+                    parser.advance()
+                    command_type = parser.command_type()
+                    pc = len(self._ops)
+                    if command_type == CommandType.C_FUNCTION:
+                        current_function = parser.arg1()
+                        self._functions[current_function] = pc
+                        op = self._compile_function(int(parser.arg2()))
+                    elif command_type == CommandType.C_LABEL:
+                        # Labels compile to nothing and resolve to the next op
+                        labels[(current_function, parser.arg1())] = pc
+                        continue
+                    elif command_type in (CommandType.C_GOTO, CommandType.C_IF):
+                        jumps.append(
+                            (pc, command_type, current_function, parser.arg1())
+                        )
+                        op = None
+                    elif command_type == CommandType.C_CALL:
+                        jumps.append((pc, command_type, None, parser.arg1()))
+                        op = int(parser.arg2())
+                    elif command_type == CommandType.C_RETURN:
+                        op = self._compile_return()
+                    elif command_type == CommandType.C_ARITHMETIC:
+                        op = self._compile_arithmetic(parser.arg1())
+                    elif command_type == CommandType.C_PUSH:
+                        op = self._compile_push(
+                            vm_file.stem, parser.arg1(), int(parser.arg2())
+                        )
+                    elif command_type == CommandType.C_POP:
+                        op = self._compile_pop(
+                            vm_file.stem, parser.arg1(), int(parser.arg2())
+                        )
+                    else:
+                        raise NotImplementedError(f"Unknown command: {parser}")
+                    self._ops.append(op)
+                    self._function_of_pc.append(current_function)
+
+        # Falling off the end of the program halts the machine
+        self._ops.append(lambda pc: -1)
+        self._function_of_pc.append(None)
+
+        for pc, command_type, function_name, target in jumps:
+            if command_type == CommandType.C_CALL:
+                if target not in self._functions:
+                    raise ValueError(f"Unknown function: {target}")
+                self._ops[pc] = self._compile_call(
+                    self._functions[target], self._ops[pc]
+                )
+                continue
+            if (function_name, target) not in labels:
+                raise ValueError(f"Unknown label: {target} in {function_name}")
+            target_pc = labels[(function_name, target)]
+            if command_type == CommandType.C_GOTO:
+                self._ops[pc] = self._compile_goto(target_pc, target_pc == pc)
+            else:
+                self._ops[pc] = self._compile_if(target_pc)
+
+    def _compile_function(self, num_locals):
+        ram = self.ram
+
+        def op(pc):
+            sp = ram[SP]
+            ram[sp : sp + num_locals] = [0] * num_locals
+            ram[SP] = sp + num_locals
+            return pc + 1
+
+        return op
+
+    def _compile_goto(self, target_pc, halts):
+        # A goto to itself is the usual "label END / goto END" idiom and
+        # halts the machine
+        if halts:
+            return lambda pc: -1
+        return lambda pc: target_pc
+
+    def _compile_if(self, target_pc):
+        ram = self.ram
+
+        def op(pc):
+            sp = ram[SP] - 1
+            ram[SP] = sp
+            return target_pc if ram[sp] != 0 else pc + 1
+
+        return op
+
+    def _compile_call(self, target_pc, num_args):
+        push_frame = self._push_frame
+
+        def op(pc):
+            push_frame(pc + 1, num_args)
+            return target_pc
+
+        return op
+
+    def _compile_return(self):
+        ram = self.ram
+        ops = self._ops
+
+        def op(pc):
+            frame = ram[LCL]
+            return_pc = ram[frame - 5]
+            ram[ram[ARG]] = ram[ram[SP] - 1]
+            ram[SP] = ram[ARG] + 1
+            ram[THAT] = ram[frame - 1]
+            ram[THIS] = ram[frame - 2]
+            ram[ARG] = ram[frame - 3]
+            ram[LCL] = ram[frame - 4]
+            if 0 <= return_pc < len(ops):
+                return return_pc
+            return -1
+
+        return op
+
+    def _compile_arithmetic(self, command):
+        ram = self.ram
+        if command in ("neg", "not"):
+            unary = (lambda x: _wrap(-x)) if command == "neg" else (lambda x: ~x)
+
+            def op(pc):
+                sp = ram[SP] - 1
+                ram[sp] = unary(ram[sp])
+                return pc + 1
+
+            return op
+
+        binary = {
+            "add": lambda x, y: _wrap(x + y),
+            "sub": lambda x, y: _wrap(x - y),
+            "and": lambda x, y: x & y,
+            "or": lambda x, y: x | y,
+            "eq": lambda x, y: -1 if x == y else 0,
+            "gt": lambda x, y: -1 if x > y else 0,
+            "lt": lambda x, y: -1 if x < y else 0,
+        }.get(command)
+        if binary is None:
+            raise NotImplementedError(f"Unknown arithmetic command: {command}")
+
+        def op(pc):
+            sp = ram[SP] - 1
+            ram[sp - 1] = binary(ram[sp - 1], ram[sp])
+            ram[SP] = sp
+            return pc + 1
+
+        return op
+
+    def _static_address(self, file_name, index):
+        symbol = f"{file_name}.{index}"
+        if symbol not in self._statics:
+            self._statics[symbol] = STATIC_BASE + len(self._statics)
+        return self._statics[symbol]
+
+    def _compile_push(self, file_name, segment, index):
+        ram = self.ram
+        if segment == "constant":
+
+            def op(pc):
+                sp = ram[SP]
+                ram[sp] = index
+                ram[SP] = sp + 1
+                return pc + 1
+
+            return op
+
+        if segment in VMInterpreter.SEGMENT_POINTERS:
+            pointer = VMInterpreter.SEGMENT_POINTERS[segment]
+
+            def op(pc):
+                sp = ram[SP]
+                ram[sp] = ram[ram[pointer] + index]
+                ram[SP] = sp + 1
+                return pc + 1
+
+            return op
+
+        address = self._fixed_address(file_name, segment, index)
+
+        def op(pc):
+            sp = ram[SP]
+            ram[sp] = ram[address]
+            ram[SP] = sp + 1
+            return pc + 1
+
+        return op
+
+    def _compile_pop(self, file_name, segment, index):
+        ram = self.ram
+        if segment in VMInterpreter.SEGMENT_POINTERS:
+            pointer = VMInterpreter.SEGMENT_POINTERS[segment]
+
+            def op(pc):
+                sp = ram[SP] - 1
+                ram[ram[pointer] + index] = ram[sp]
+                ram[SP] = sp
+                return pc + 1
+
+            return op
+
+        address = self._fixed_address(file_name, segment, index)
+
+        def op(pc):
+            sp = ram[SP] - 1
+            ram[address] = ram[sp]
+            ram[SP] = sp
+            return pc + 1
+
+        return op
+
+    def _fixed_address(self, file_name, segment, index):
+        if segment == "static":
+            return self._static_address(file_name, index)
+        if segment in VMInterpreter.FIXED_SEGMENTS:
+            return VMInterpreter.FIXED_SEGMENTS[segment] + index
+        raise NotImplementedError(f"unknown segment: {segment}")
+
+
+class VMTestScript:
+    NAMED_REGISTERS = {
+        "sp": SP,
+        "local": LCL,
+        "argument": ARG,
+        "this": THIS,
+        "that": THAT,
+    }
+    COMMAND_PATTERN = re.compile(
+        r"repeat\s+(\d+)\s*\{(.*?)\}|([^,;{}]+)[,;]", re.DOTALL
+    )
+    OUTPUT_PATTERN = re.compile(r"(\S+?)%D(\d+)\.(\d+)\.(\d+)")
+
+    def __init__(self, tst_file: pathlib.Path):
+        self._tst_file = tst_file
+        source = tst_file.read_text(encoding="UTF-8")
+        self._source = re.sub(r"//[^\n]*", "", source)
+
+    def run(self, interpreter: VMInterpreter):
+        outputs = []
+        output_list = []
+        for match in VMTestScript.COMMAND_PATTERN.finditer(self._source):
+            if match.group(1) is not None:
+                interpreter.run(int(match.group(1)) * match.group(2).count("vmstep"))
+                continue
+            words = match.group(3).split()
+            if len(words) == 0:
+                continue
+            if words[0] == "set":
+                interpreter.ram[self._address(interpreter, words[1])] = int(words[2])
+            elif words[0] == "vmstep":
+                interpreter.run(1)
+            elif words[0] == "output-list":
+                output_list = [
+                    VMTestScript.OUTPUT_PATTERN.fullmatch(word).groups()
+                    for word in words[1:]
+                ]
+            elif words[0] == "output":
+                outputs.append(self._format_header(output_list))
+                outputs.append(self._format_values(interpreter, output_list))
+        return outputs
+
+    def _address(self, interpreter, target):
+        if target in VMTestScript.NAMED_REGISTERS:
+            return VMTestScript.NAMED_REGISTERS[target]
+        name, index = target[:-1].split("[")
+        if name == "RAM":
+            return int(index)
+        if name in VMTestScript.NAMED_REGISTERS:
+            return interpreter.ram[VMTestScript.NAMED_REGISTERS[name]] + int(index)
+        if name in VMInterpreter.FIXED_SEGMENTS:
+            return VMInterpreter.FIXED_SEGMENTS[name] + int(index)
+        raise NotImplementedError(f"unknown test target: {target}")
+
+    def _format_header(self, output_list):
+        cells = []
+        for name, left, width, right in output_list:
+            total = int(left) + int(width) + int(right)
+            cells.append(name[:total].center(total))
+        return "|" + "|".join(cells) + "|"
+
+    def _format_values(self, interpreter, output_list):
+        cells = []
+        for name, left, width, right in output_list:
+            value = interpreter.ram[self._address(interpreter, name)]
+            cells.append(
+                " " * int(left) + str(value).rjust(int(width)) + " " * int(right)
+            )
+        return "|" + "|".join(cells) + "|"
+
+
+def _compare(outputs, cmp_file: pathlib.Path):
+    expected = cmp_file.read_text(encoding="UTF-8").split()
+    actual = "\n".join(outputs).split()
+    return expected == actual
+
+
+def _print_profile(interpreter: VMInterpreter):
+    print(f"{'function':<40} {'calls':>10} {'instructions':>14}")
+    profile = sorted(interpreter.profile().items(), key=lambda item: -item[1][1])
+    for function_name, (calls, instructions) in profile:
+        print(f"{function_name:<40} {calls:>10} {instructions:>14}")
+    print(f"total instructions: {interpreter.steps}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vm", type=str, required=True)
+    parser.add_argument("--tst", type=str, default=None)
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+
+    vm_path = pathlib.Path(args.vm)
+    if vm_path.is_dir():
+        vm_files = sorted(vm for vm in vm_path.iterdir() if vm.suffix == ".vm")
+    else:
+        vm_files = [vm_path]
+
+    interpreter = VMInterpreter(vm_files)
+    if args.profile:
+        interpreter.enable_profiling()
+
+    if args.tst is not None:
+        tst_file = pathlib.Path(args.tst)
+        # Like the VM emulator, tests start directly at Sys.init without a frame
+        if interpreter.has_function("Sys.init"):
+            interpreter.enter("Sys.init")
+        outputs = VMTestScript(tst_file).run(interpreter)
+        for line in outputs:
+            print(line)
+        cmp_file = tst_file.with_name(tst_file.stem.replace("VME", "") + ".cmp")
+        if cmp_file.exists():
+            passed = _compare(outputs, cmp_file)
+            print(f"Comparison {'succeeded' if passed else 'failed'}: {cmp_file}")
+            if not passed:
+                raise SystemExit(1)
+    else:
+        if interpreter.has_function("Sys.init"):
+            interpreter.bootstrap()
+        else:
+            interpreter.ram[SP] = 256
+        interpreter.run(args.max_steps)
+        print(
+            f"SP: {interpreter.ram[SP]} top of stack: {interpreter.ram[interpreter.ram[SP] - 1]}"
+        )
+
+    if args.profile:
+        _print_profile(interpreter)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,31 @@ import pathlib
 
 import argparse
 
+import hashlib
+
+import io
+
+import json
+
+import sys
+
+import time
+
 from enum import Enum
 
+# line_lexer.py, tracing.py and watcher.py at the repository root are shared
+# with the other tools
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+import tracing
+
+import watcher
+
+from line_lexer import is_stream, lex_fields
+
+# Static variables of a VM program read from stdin are named after this file
+STREAM_FILE_NAME = "Stdin.vm"
+
 
 class CommandType(Enum):
     C_ARITHMETIC = 1
@@ -31,6 +54,18 @@ class Parser:
         "or",
         "not",
     ]
+    # One lookup per command, where a chain of comparisons took up to nine
+    COMMAND_TYPES = {
+        **{command: CommandType.C_ARITHMETIC for command in ARITHMETIC_COMMANDS},
+        "pop": CommandType.C_POP,
+        "push": CommandType.C_PUSH,
+        "label": CommandType.C_LABEL,
+        "goto": CommandType.C_GOTO,
+        "if-goto": CommandType.C_IF,
+        "call": CommandType.C_CALL,
+        "return": CommandType.C_RETURN,
+        "function": CommandType.C_FUNCTION,
+    }
 
     def __init__(self, vm_file):
         self._vm_file = vm_file
@@ -45,61 +80,51 @@ class Parser:
         self.close()
 
     def __repr__(self):
-        if self.command_type() == CommandType.C_ARITHMETIC:
+        command_type = self.command_type()
+        if command_type == CommandType.C_ARITHMETIC:
             return f"ARITHMETIC command: {self.arg1()}"
-        if self.command_type() == CommandType.C_PUSH:
+        if command_type == CommandType.C_PUSH:
             return f"PUSH arg1: {self.arg1()} arg2: {self.arg2()}"
-        if self.command_type() == CommandType.C_POP:
+        if command_type == CommandType.C_POP:
             return f"POP arg1: {self.arg1()} arg2: {self.arg2()}"
-        if self.command_type() == CommandType.C_LABEL:
+        if command_type == CommandType.C_LABEL:
             return f"LABEL arg1: {self.arg1()}"
-        if self.command_type() == CommandType.C_GOTO:
+        if command_type == CommandType.C_GOTO:
             return f"GOTO arg1: {self.arg1()}"
-        if self.command_type() == CommandType.C_IF:
+        if command_type == CommandType.C_IF:
             return f"IF-GOTO arg1: {self.arg1()}"
-        if self.command_type() == CommandType.C_FUNCTION:
+        if command_type == CommandType.C_FUNCTION:
             return f"FUNCTION arg1: {self.arg1()} arg2: {self.arg2()}"
-        if self.command_type() == CommandType.C_RETURN:
+        if command_type == CommandType.C_RETURN:
             return f"RETURN"
-        if self.command_type() == CommandType.C_CALL:
+        if command_type == CommandType.C_CALL:
             return f"CALL arg1: {self.arg1()} arg2: {self.arg2()}"
         return "Unknown command"
 
+    def __iter__(self):
+        while self.has_more_commands():
+            self.advance()
+            yield self.command_type()
+
     def open(self):
-        self._file = open(self._vm_file, "r", encoding="UTF-8")
-        self._next_command = self._retrieve_next_command()
+        self._commands = iter(lex_fields(self._vm_file))
+        self._next_command = next(self._commands, None)
 
     def close(self):
-        if not self._file.closed:
-            self._file.close()
+        self._commands = None
 
     def has_more_commands(self):
         return self._next_command is not None
 
     def advance(self):
         self._current_command = self._next_command
-        self._next_command = self._retrieve_next_command()
+        self._next_command = next(self._commands, None)
 
     def command_type(self) -> CommandType:
-        if self._current_command[0] in Parser.ARITHMETIC_COMMANDS:
-            return CommandType.C_ARITHMETIC
-        if self._current_command[0] == "pop":
-            return CommandType.C_POP
-        if self._current_command[0] == "push":
-            return CommandType.C_PUSH
-        if self._current_command[0] == "label":
-            return CommandType.C_LABEL
-        if self._current_command[0] == "goto":
-            return CommandType.C_GOTO
-        if self._current_command[0] == "if-goto":
-            return CommandType.C_IF
-        if self._current_command[0] == "call":
-            return CommandType.C_CALL
-        if self._current_command[0] == "return":
-            return CommandType.C_RETURN
-        if self._current_command[0] == "function":
-            return CommandType.C_FUNCTION
-        raise ValueError(f"Unknown command: {self._current_command[0]}")
+        command_type = Parser.COMMAND_TYPES.get(self._current_command[0])
+        if command_type is None:
+            raise ValueError(f"Unknown command: {self._current_command[0]}")
+        return command_type
 
     def arg1(self):
         if len(self._current_command) == 1:
@@ -110,39 +135,24 @@ class Parser:
     def arg2(self):
         return self._current_command[2]
 
-    def _remove_tabs(self, line: str):
-        return line.replace("\t", "")
-
-    def _remove_new_line(self, line: str):
-        return line.replace("\n", "")
-
-    def _remove_comment(self, line: str):
-        command_index = line.find("//")
-        if command_index == -1:
-            return line
-        else:
-            return line[:command_index]
-
-    def _retrieve_next_command(self):
-        command = self._file.readline()
-        while len(command) != 0:
-            command = self._remove_tabs(command)
-            command = self._remove_new_line(command)
-            command = self._remove_comment(command)
-            command = [c for c in command.split(" ") if " " not in c and len(c) != 0]
-            if len(command) != 0:
-                return command
-            else:
-                command = self._file.readline()
-        return None
-
 
 class CodeWriter:
+    # Rendered output is handed to the file once this many characters are buffered
+    FLUSH_SIZE = 1 << 16
+
     def __init__(self, asm_file):
         self._asm_file = asm_file
         self._vm_file = None
+        self._function_name = None
         self._label_count = 0
         self._return_count = 0
+        self._templates = {}
+        self._lines = None
+        self._chunks = []
+        self._buffered_size = 0
+        self._written_chars = 0
+        self._written_lines = 0
+        self._captured = None
 
     def __enter__(self):
         self.open()
@@ -152,42 +162,159 @@ class CodeWriter:
         self.close()
 
     def open(self):
-        self._file = open(self._asm_file, "w", encoding="UTF-8")
+        if is_stream(self._asm_file):
+            self._file = self._asm_file
+        else:
+            self._file = open(self._asm_file, "w", encoding="UTF-8")
 
     def close(self):
         if not self._file.closed:
-            self._file.close()
+            self._flush()
+            if self._file is self._asm_file:
+                self._file.flush()
+            else:
+                self._file.close()
 
     def set_file_name(self, file_name):
         self._vm_file = file_name
 
+    def written_chars(self):
+        return self._written_chars + self._buffered_size
+
+    def written_lines(self):
+        return self._written_lines + sum(chunk.count("\n") for chunk in self._chunks)
+
+    def state(self):
+        # What the asm of a command depends on besides the command and the
+        # file name
+        return self._function_name, self._label_count, self._return_count
+
+    def begin_capture(self):
+        # Output written until end_capture() is also returned by it
+        self._flush()
+        self._captured = []
+
+    def end_capture(self):
+        self._flush()
+        captured = "".join(self._captured)
+        self._captured = None
+        return captured
+
+    def write_captured(self, asm, state):
+        # Writes asm captured earlier and continues from the state it ended in
+        self._write(asm)
+        self._function_name, self._label_count, self._return_count = state
+
     def write_init(self):
-        self._file.write(f"@256" + "\n")
-        self._file.write(f"D=A" + "\n")
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._write(self._template(("init",), self._render_init))
         self.write_call("Sys.init", 0)
 
     def write_label(self, label):
-        self._file.write(f"({label})" + "\n")
+        self._write(f"({self._scoped_label(label)})\n")
 
     def write_goto(self, label):
-        self._file.write(f"@{label}" + "\n")
-        self._file.write(f"0;JMP" + "\n")
+        self._write(f"@{self._scoped_label(label)}\n0;JMP\n")
 
     def write_if(self, label):
-        self._pop_stack_to_D()
-        self._file.write(f"@{label}" + "\n")
-        self._file.write(f"D;JNE" + "\n")
+        template = self._template(("if-goto",), self._render_if, "{label}")
+        self._write(template.format(label=self._scoped_label(label)))
 
     def write_call(self, function_name, num_args):
-        self._file.write(f"@{function_name}-return-{self._return_count}" + "\n")
-        self._file.write(f"D=A" + "\n")
+        # Templates are keyed by shape alone, with the names filled in on
+        # every write, so the cache does not grow with the number of functions
+        template = self._template(
+            ("call", num_args), self._render_call, "{name}", num_args
+        )
+        self._write(template.format(name=function_name, count=self._return_count))
+        self._return_count += 1
+
+    def write_return(self):
+        self._write(self._template(("return",), self._render_return))
+
+    def write_function(self, function_name, num_locals):
+        self._function_name = function_name
+        template = self._template(
+            ("function", num_locals), self._render_function, "{name}", num_locals
+        )
+        self._write(template.format(name=function_name))
+
+    def _scoped_label(self, label):
+        # Labels are local to the function they appear in, so compilers can
+        # reuse names such as WHILE_EXP0 in every function
+        if self._function_name is None:
+            return label
+        return f"{self._function_name}${label}"
+
+    def write_arithmetic(self, command):
+        template = self._template(
+            ("arithmetic", command), self._render_arithmetic, command
+        )
+        if command in ("eq", "gt", "lt"):
+            template = template.format(count=self._label_count)
+            self._label_count += 1
+        self._write(template)
+
+    def write_push_pop(self, command, segment, index):
+        key = (command, segment, index)
+        # Most commands are push and pop, so their cache hit skips _template
+        template = self._templates.get(key)
+        if template is None:
+            template = self._template(
+                key, self._render_push_pop, command, segment, index
+            )
+        if segment == "static":
+            # Static variables are named after the vm file
+            template = template.format(name=self._vm_file)
+        self._write(template)
+
+    def _template(self, key, render, *args):
+        template = self._templates.get(key)
+        if template is None:
+            self._lines = []
+            render(*args)
+            template = "\n".join(self._lines) + "\n"
+            self._lines = None
+            self._templates[key] = template
+        return template
+
+    def _emit(self, line):
+        self._lines.append(line)
+
+    def _write(self, text):
+        self._chunks.append(text)
+        self._buffered_size += len(text)
+        if self._buffered_size >= CodeWriter.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        text = "".join(self._chunks)
+        self._file.write(text)
+        if self._captured is not None:
+            self._captured.append(text)
+        self._written_chars += len(text)
+        self._written_lines += text.count("\n")
+        self._chunks = []
+        self._buffered_size = 0
+
+    def _render_init(self):
+        self._emit(f"@256")
+        self._emit(f"D=A")
+        self._emit(f"@SP")
+        self._emit(f"M=D")
+
+    def _render_if(self, label):
+        self._pop_stack_to_D()
+        self._emit(f"@{label}")
+        self._emit(f"D;JNE")
+
+    def _render_call(self, function_name, num_args):
+        self._emit(f"@{function_name}-return-{{count}}")
+        self._emit(f"D=A")
         self._push_D_to_stack()
 
         def _push_address(src_address):
-            self._file.write(f"@{src_address}" + "\n")
-            self._file.write(f"D=M" + "\n")
+            self._emit(f"@{src_address}")
+            self._emit(f"D=M")
             self._push_D_to_stack()
 
         _push_address(f"LCL")
@@ -196,78 +323,77 @@ class CodeWriter:
         _push_address(f"THAT")
 
         # ARG = SP - n - 5
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"D=M" + "\n")
-        self._file.write(f"@{num_args+5}" + "\n")
-        self._file.write(f"D=D-A" + "\n")
-        self._file.write(f"@ARG" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"D=M")
+        self._emit(f"@{num_args+5}")
+        self._emit(f"D=D-A")
+        self._emit(f"@ARG")
+        self._emit(f"M=D")
 
         # LCL = SP
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"D=M" + "\n")
-        self._file.write(f"@LCL" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"D=M")
+        self._emit(f"@LCL")
+        self._emit(f"M=D")
 
-        self._file.write(f"@{function_name}" + "\n")
-        self._file.write(f"0;JMP" + "\n")
+        self._emit(f"@{function_name}")
+        self._emit(f"0;JMP")
 
-        self._file.write(f"({function_name}-return-{self._return_count})" + "\n")
-        self._return_count += 1
+        self._emit(f"({function_name}-return-{{count}})")
 
-    def write_return(self):
+    def _render_return(self):
         def _set_address_to_pointer(src_address, dst_pointer, value):
-            self._file.write(f"@{src_address}" + "\n")
-            self._file.write(f"D=M" + "\n")
+            self._emit(f"@{src_address}")
+            self._emit(f"D=M")
             if value > 0:
-                self._file.write(f"@{abs(value)}" + "\n")
-                self._file.write(f"A=D+A" + "\n")
+                self._emit(f"@{abs(value)}")
+                self._emit(f"A=D+A")
             elif value < 0:
-                self._file.write(f"@{abs(value)}" + "\n")
-                self._file.write(f"A=D-A" + "\n")
+                self._emit(f"@{abs(value)}")
+                self._emit(f"A=D-A")
             else:
-                self._file.write(f"A=D" + "\n")
+                self._emit(f"A=D")
 
-            self._file.write(f"D=M" + "\n")
-            self._file.write(f"@{dst_pointer}" + "\n")
-            self._file.write(f"M=D" + "\n")
+            self._emit(f"D=M")
+            self._emit(f"@{dst_pointer}")
+            self._emit(f"M=D")
 
-        self._file.write(f"@LCL" + "\n")
-        self._file.write(f"D=M" + "\n")
-        self._file.write(f"@FRAME" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@LCL")
+        self._emit(f"D=M")
+        self._emit(f"@FRAME")
+        self._emit(f"M=D")
 
         _set_address_to_pointer("FRAME", "RET", -5)
 
         # *ARG = pop()
         self._pop_stack_to_D()
-        self._file.write(f"@ARG" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@ARG")
+        self._emit(f"A=M")
+        self._emit(f"M=D")
 
         # SP = ARG + 1
-        self._file.write(f"@ARG" + "\n")
-        self._file.write(f"D=M" + "\n")
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"M=D+1" + "\n")
+        self._emit(f"@ARG")
+        self._emit(f"D=M")
+        self._emit(f"@SP")
+        self._emit(f"M=D+1")
 
         _set_address_to_pointer("FRAME", "THAT", -1)
         _set_address_to_pointer("FRAME", "THIS", -2)
         _set_address_to_pointer("FRAME", "ARG", -3)
         _set_address_to_pointer("FRAME", "LCL", -4)
 
-        self._file.write(f"@RET" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"0;JMP" + "\n")
+        self._emit(f"@RET")
+        self._emit(f"A=M")
+        self._emit(f"0;JMP")
 
-    def write_function(self, function_name, num_locals):
-        self._file.write(f"({function_name})" + "\n")
+    def _render_function(self, function_name, num_locals):
+        self._emit(f"({function_name})")
         for _ in range(num_locals):
-            self._file.write(f"@0" + "\n")
-            self._file.write(f"D=A" + "\n")
+            self._emit(f"@0")
+            self._emit(f"D=A")
             self._push_D_to_stack()
 
-    def write_arithmetic(self, command):
+    def _render_arithmetic(self, command):
         if command == "add":
             self._write_add()
         elif command == "sub":
@@ -289,7 +415,7 @@ class CodeWriter:
         else:
             raise NotImplementedError
 
-    def write_push_pop(self, command, segment, index):
+    def _render_push_pop(self, command, segment, index):
         if command == CommandType.C_POP:
             self._pop_data_from_stack(segment, index)
         elif command == CommandType.C_PUSH:
@@ -300,18 +426,18 @@ class CodeWriter:
     def _write_add(self):
         self._pop_stack_to_D()
         self._pop_stack_to_A()
-        self._file.write(f"D=D+A" + "\n")
+        self._emit(f"D=D+A")
         self._push_D_to_stack()
 
     def _write_sub(self):
         self._pop_stack_to_D()
         self._pop_stack_to_A()
-        self._file.write(f"D=A-D" + "\n")
+        self._emit(f"D=A-D")
         self._push_D_to_stack()
 
     def _write_neg(self):
         self._pop_stack_to_D()
-        self._file.write(f"D=-D" + "\n")
+        self._emit(f"D=-D")
         self._push_D_to_stack()
 
     def _write_eq(self):
@@ -326,65 +452,63 @@ class CodeWriter:
     def _write_and(self):
         self._pop_stack_to_D()
         self._pop_stack_to_A()
-        self._file.write(f"D=D&A" + "\n")
+        self._emit(f"D=D&A")
         self._push_D_to_stack()
 
     def _write_or(self):
         self._pop_stack_to_D()
         self._pop_stack_to_A()
-        self._file.write(f"D=D|A" + "\n")
+        self._emit(f"D=D|A")
         self._push_D_to_stack()
 
     def _write_not(self):
         self._pop_stack_to_D()
-        self._file.write(f"D=!D" + "\n")
+        self._emit(f"D=!D")
         self._push_D_to_stack()
 
     def _write_jump(self, condition):
         self._pop_stack_to_D()
         self._pop_stack_to_A()
-        self._file.write(f"D=A-D" + "\n")
+        self._emit(f"D=A-D")
 
-        self._file.write(f"@JMP_LABEL{self._label_count}" + "\n")
-        self._file.write(f"D;{condition}" + "\n")
+        self._emit(f"@JMP_LABEL{{count}}")
+        self._emit(f"D;{condition}")
 
-        self._file.write(f"D=0" + "\n")
+        self._emit(f"D=0")
         self._push_D_to_stack()
-        self._file.write(f"@JMP_END{self._label_count}" + "\n")
-        self._file.write(f"0;JMP" + "\n")
+        self._emit(f"@JMP_END{{count}}")
+        self._emit(f"0;JMP")
 
-        self._file.write(f"(JMP_LABEL{self._label_count})" + "\n")
-        self._file.write(f"D=-1" + "\n")
+        self._emit(f"(JMP_LABEL{{count}})")
+        self._emit(f"D=-1")
         self._push_D_to_stack()
-        self._file.write(f"(JMP_END{self._label_count})" + "\n")
-
-        self._label_count += 1
+        self._emit(f"(JMP_END{{count}})")
 
     def _pop_stack_to_A(self):
         self._decrement_stack_pointer()
 
         # pop from stack
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"A=M" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"A=M")
+        self._emit(f"A=M")
 
     def _pop_stack_to_D(self):
         self._decrement_stack_pointer()
 
         # pop from stack
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"D=M" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"A=M")
+        self._emit(f"D=M")
 
     def _pop_data_from_stack(self, segment, index):
         self._set_address_to_D(segment, index)
-        self._file.write(f"@R13" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@R13")
+        self._emit(f"M=D")
 
         self._pop_stack_to_D()
-        self._file.write(f"@R13" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@R13")
+        self._emit(f"A=M")
+        self._emit(f"M=D")
 
     def _push_data_to_stack(self, segment, index):
         self._set_data_to_D(segment, index)
@@ -392,61 +516,61 @@ class CodeWriter:
 
     def _push_D_to_stack(self):
         # push to stack
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"A=M" + "\n")
-        self._file.write(f"M=D" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"A=M")
+        self._emit(f"M=D")
 
         self._increment_stack_pointer()
 
     def _decrement_stack_pointer(self):
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"M=M-1" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"M=M-1")
 
     def _increment_stack_pointer(self):
         # increment stack pointer
-        self._file.write(f"@SP" + "\n")
-        self._file.write(f"M=M+1" + "\n")
+        self._emit(f"@SP")
+        self._emit(f"M=M+1")
 
     def _set_data_to_D(self, segment, index):
         if segment == "constant":
-            self._file.write(f"@{index}" + "\n")
-            self._file.write(f"D=A" + "\n")
+            self._emit(f"@{index}")
+            self._emit(f"D=A")
         elif segment == "static":
-            self._file.write(f"@{self._vm_file}.{index}" + "\n")
-            self._file.write(f"D=M" + "\n")
+            self._emit(f"@{{name}}.{index}")
+            self._emit(f"D=M")
         elif segment == "pointer" or segment == "temp":
             address = self._retrieve_segment_address(segment)
-            self._file.write(f"@{address}" + "\n")
-            self._file.write(f"D=A" + "\n")
-            self._file.write(f"@{index}" + "\n")
-            self._file.write(f"A=A+D" + "\n")
-            self._file.write(f"D=M" + "\n")
+            self._emit(f"@{address}")
+            self._emit(f"D=A")
+            self._emit(f"@{index}")
+            self._emit(f"A=A+D")
+            self._emit(f"D=M")
         else:
             address = self._retrieve_segment_address(segment)
-            self._file.write(f"@{address}" + "\n")
-            self._file.write(f"D=M" + "\n")
-            self._file.write(f"@{index}" + "\n")
-            self._file.write(f"A=A+D" + "\n")
-            self._file.write(f"D=M" + "\n")
+            self._emit(f"@{address}")
+            self._emit(f"D=M")
+            self._emit(f"@{index}")
+            self._emit(f"A=A+D")
+            self._emit(f"D=M")
 
     def _set_address_to_D(self, segment, index):
         if segment == "constant":
             raise NotImplementedError
         elif segment == "static":
-            self._file.write(f"@{self._vm_file}.{index}" + "\n")
-            self._file.write(f"D=A" + "\n")
+            self._emit(f"@{{name}}.{index}")
+            self._emit(f"D=A")
         elif segment == "pointer" or segment == "temp":
             address = self._retrieve_segment_address(segment)
-            self._file.write(f"@{address}" + "\n")
-            self._file.write(f"D=A" + "\n")
-            self._file.write(f"@{index}" + "\n")
-            self._file.write(f"D=A+D" + "\n")
+            self._emit(f"@{address}")
+            self._emit(f"D=A")
+            self._emit(f"@{index}")
+            self._emit(f"D=A+D")
         else:
             address = self._retrieve_segment_address(segment)
-            self._file.write(f"@{address}" + "\n")
-            self._file.write(f"D=M" + "\n")
-            self._file.write(f"@{index}" + "\n")
-            self._file.write(f"D=A+D" + "\n")
+            self._emit(f"@{address}")
+            self._emit(f"D=M")
+            self._emit(f"@{index}")
+            self._emit(f"D=A+D")
 
     def _retrieve_segment_address(self, segment):
         if segment == "local":
@@ -464,53 +588,218 @@ class CodeWriter:
         raise NotImplementedError(f"unknown segment: {segment}")
 
 
-def translate(out_file: pathlib.Path, vm_files: Sequence[pathlib.Path]):
-    with CodeWriter(out_file) as writer:
+class TranslationStats:
+    def __init__(self):
+        self.command_counts = {command_type.name: 0 for command_type in CommandType}
+        self.files = 0
+        self.parse_time = 0.0
+        self.emit_time = 0.0
+        self.output_chars = 0
+        self.output_lines = 0
+
+    def add_command(self, command_type, parse_time, emit_time):
+        self.command_counts[command_type.name] += 1
+        self.parse_time += parse_time
+        self.emit_time += emit_time
+
+    def total_commands(self):
+        return sum(self.command_counts.values())
+
+    def to_dict(self):
+        return {
+            "files": self.files,
+            "commands": self.total_commands(),
+            "command_counts": self.command_counts,
+            "parse_time": self.parse_time,
+            "emit_time": self.emit_time,
+            "output_chars": self.output_chars,
+            "output_lines": self.output_lines,
+        }
+
+    def report(self, file=sys.stdout):
+        print(f"files: {self.files} commands: {self.total_commands()}", file=file)
+        for name, count in self.command_counts.items():
+            if count != 0:
+                print(f"  {name}: {count}", file=file)
+        print(f"parse: {self.parse_time:.6f}s emit: {self.emit_time:.6f}s", file=file)
+        print(
+            f"output: {self.output_chars} characters, {self.output_lines} lines",
+            file=file,
+        )
+
+
+def _write_command(writer: CodeWriter, parser: Parser, command_type: CommandType):
+    if command_type == CommandType.C_PUSH or command_type == CommandType.C_POP:
+        writer.write_push_pop(command_type, parser.arg1(), parser.arg2())
+    elif command_type == CommandType.C_ARITHMETIC:
+        writer.write_arithmetic(parser.arg1())
+    elif command_type == CommandType.C_LABEL:
+        writer.write_label(parser.arg1())
+    elif command_type == CommandType.C_GOTO:
+        writer.write_goto(parser.arg1())
+    elif command_type == CommandType.C_IF:
+        writer.write_if(parser.arg1())
+    elif command_type == CommandType.C_CALL:
+        writer.write_call(parser.arg1(), int(parser.arg2()))
+    elif command_type == CommandType.C_RETURN:
+        writer.write_return()
+    elif command_type == CommandType.C_FUNCTION:
+        writer.write_function(parser.arg1(), int(parser.arg2()))
+
+
+class TranslationCache:
+    # asm of the .vm files translated by earlier runs of --watch. The asm of
+    # a file depends on its name and content and on the writer state it
+    # starts from, which make up the key, so an edit that leaves the label
+    # and return counts alone keeps the entries of the files after it.
+    def __init__(self):
+        self._entries = {}
+
+    def lookup(self, key):
+        return self._entries.get(key)
+
+    def record(self, key, asm, state):
+        self._entries[key] = (asm, state)
+
+
+def translate(
+    out_file: pathlib.Path,
+    vm_files: Sequence[pathlib.Path],
+    stats: TranslationStats = None,
+    verbose=False,
+    cache: TranslationCache = None,
+):
+    # Keep stdout clean for the asm when it is streamed there
+    log = sys.stderr if is_stream(out_file) else sys.stdout
+    with tracing.span("translate"), CodeWriter(out_file) as writer:
         writer.write_init()
         for vm_file in vm_files:
-            writer.set_file_name(vm_file.name)
-            with Parser(vm_file) as parser:
-                while parser.has_more_commands():
-                    parser.advance()
-                    print(f"command: {parser}")
-                    if parser.command_type() == CommandType.C_LABEL:
-                        writer.write_label(parser.arg1())
-                    if parser.command_type() == CommandType.C_GOTO:
-                        writer.write_goto(parser.arg1())
-                    if parser.command_type() == CommandType.C_IF:
-                        writer.write_if(parser.arg1())
-                    if parser.command_type() == CommandType.C_CALL:
-                        writer.write_call(parser.arg1(), int(parser.arg2()))
-                    if parser.command_type() == CommandType.C_RETURN:
-                        writer.write_return()
-                    if parser.command_type() == CommandType.C_FUNCTION:
-                        writer.write_function(parser.arg1(), int(parser.arg2()))
-                    if parser.command_type() == CommandType.C_ARITHMETIC:
-                        writer.write_arithmetic(parser.arg1())
-                    if parser.command_type() == CommandType.C_PUSH:
-                        writer.write_push_pop(
-                            parser.command_type(), parser.arg1(), parser.arg2()
-                        )
-                    if parser.command_type() == CommandType.C_POP:
-                        writer.write_push_pop(
-                            parser.command_type(), parser.arg1(), parser.arg2()
-                        )
+            # A (file name, stream) pair names the statics of an in-memory file
+            if isinstance(vm_file, tuple):
+                file_name, vm_file = vm_file
+            elif is_stream(vm_file):
+                file_name = STREAM_FILE_NAME
+            else:
+                file_name = vm_file.name
+            writer.set_file_name(file_name)
+            with tracing.span("file", file=file_name):
+                if cache is not None and not is_stream(vm_file):
+                    _translate_cached(
+                        writer, vm_file, file_name, cache, stats, verbose, log
+                    )
+                else:
+                    _translate_file(writer, vm_file, stats, verbose, log)
+        tracing.count("asm_lines", writer.written_lines())
+        if stats is not None:
+            stats.output_chars = writer.written_chars()
+            stats.output_lines = writer.written_lines()
+
+
+def _translate_cached(
+    writer: CodeWriter, vm_file, file_name, cache: TranslationCache, stats, verbose, log
+):
+    # The file is read once and translated from the same text that its key
+    # is made of
+    with open(vm_file, "r", encoding="UTF-8") as f:
+        text = f.read()
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    key = (file_name, digest, writer.state())
+    entry = cache.lookup(key)
+    if entry is not None:
+        writer.write_captured(*entry)
+        return
+    writer.begin_capture()
+    _translate_file(writer, text.splitlines(), stats, verbose, log)
+    cache.record(key, writer.end_capture(), writer.state())
+
+
+def _translate_file(writer: CodeWriter, vm_file, stats, verbose, log):
+    clock = time.perf_counter
+    start = clock() if stats is not None else 0.0
+    with Parser(vm_file) as parser:
+        if stats is not None:
+            # A path is lexed in full when the parser opens
+            stats.parse_time += clock() - start
+        commands = iter(parser)
+        num_commands = 0
+        while True:
+            start = clock() if stats is not None else 0.0
+            command_type = next(commands, None)
+            if command_type is None:
+                break
+            num_commands += 1
+            if verbose:
+                print(f"command: {parser}", file=log)
+            if stats is None:
+                _write_command(writer, parser, command_type)
+                continue
+            parsed = clock()
+            _write_command(writer, parser, command_type)
+            stats.add_command(command_type, parsed - start, clock() - parsed)
+    tracing.count("vm_commands", num_commands)
+    if stats is not None:
+        stats.files += 1
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--vm", type=str, required=True)
+    parser.add_argument("--out", type=str, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--stats-json", type=str, default=None)
+    watcher.add_arguments(parser)
+    tracing.add_arguments(parser)
     args = parser.parse_args()
+    if args.watch and args.vm == "-":
+        parser.error("--watch needs a .vm file or directory, not stdin")
 
     vm_file = pathlib.Path(args.vm)
-    if vm_file.is_dir():
-        vm_files = [vm for vm in vm_file.iterdir() if vm.suffix == ".vm"]
+    if args.vm == "-":
+        out_file = sys.stdout
+    elif vm_file.is_dir():
         out_file = vm_file / (vm_file.name + ".asm")
     else:
-        vm_files = [vm_file]
         out_file = vm_file.with_suffix(".asm")
-    print(f"vm files: {vm_files}")
-    translate(out_file=out_file, vm_files=vm_files)
+    if args.out == "-":
+        out_file = sys.stdout
+    elif args.out is not None:
+        out_file = pathlib.Path(args.out)
+    log = sys.stderr if out_file is sys.stdout else sys.stdout
+    # Under --watch the asm of unchanged files is kept between runs
+    cache = TranslationCache() if args.watch else None
+
+    def list_vm_files():
+        if args.vm == "-":
+            # Decode stdin like a file opened by Parser, with universal newlines
+            return [io.TextIOWrapper(sys.stdin.buffer, encoding="UTF-8")]
+        if vm_file.is_dir():
+            return [vm for vm in vm_file.iterdir() if vm.suffix == ".vm"]
+        return [vm_file]
+
+    def run():
+        vm_files = list_vm_files()
+        if args.verbose:
+            print(f"vm files: {vm_files}", file=log)
+        stats = TranslationStats() if args.stats or args.stats_json else None
+        translate(
+            out_file=out_file,
+            vm_files=vm_files,
+            stats=stats,
+            verbose=args.verbose,
+            cache=cache,
+        )
+        if args.stats:
+            stats.report(file=log)
+        if args.stats_json:
+            with open(args.stats_json, "w", encoding="UTF-8") as f:
+                json.dump(stats.to_dict(), f, indent=2)
+
+    with tracing.traced(args.trace, args.trace_format):
+        if args.watch:
+            watcher.watch(vm_file, list_vm_files, run, args.interval, log)
+        else:
+            run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import pathlib
+
+import shutil
+
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "project10"))
+
+import jack_analyzer
+
+from jack_analyzer import JackTokenizer, StreamingJackTokenizer, analyze
+
+# Course programs with reference XML: <Name>T.xml for the tokens and
+# <Name>.xml for the parse of each <Name>.jack
+REFERENCE_PROGRAMS = ["ArrayTest", "ExpressionLessSquare", "Square"]
+
+MODES = {
+    "plain": [],
+    "stream": ["--stream"],
+    "jobs": ["--jobs", "2"],
+}
+
+EDGE_CASES = {
+    "comment markers in strings": (
+        "class Main { function void main() {\n"
+        '    do Output.printString("a // b /* c */ d"); do Output.printString("*/");\n'
+        "    return; } }\n"
+    ),
+    "comments on one line": (
+        "class Main { /* a */ field int x; /* b */ /* c */ field int y; /** d */ }\n"
+        "/* e */ // f\n"
+    ),
+    "no newline at the end": "class Main {\n    field int x;\n} // last line",
+    "comment at the end": "class Main {\n}\n/* not closed",
+}
+
+
+def _lines(path: pathlib.Path):
+    # The reference files are indented and have CRLF line endings
+    return [line.strip() for line in path.read_text(encoding="UTF-8").splitlines()]
+
+
+def _tokens(tokenizer: JackTokenizer):
+    tokens = []
+    with tokenizer:
+        while tokenizer.has_more_tokens():
+            tokenizer.advance()
+            tokens.append(
+                (
+                    tokenizer.token_type(),
+                    tokenizer.current_token(),
+                    tokenizer.position(),
+                )
+            )
+    return tokens
+
+
+@pytest.mark.parametrize("mode", list(MODES))
+@pytest.mark.parametrize("program", REFERENCE_PROGRAMS)
+def test_matches_reference_xml(program, mode, tmp_path: pathlib.Path, monkeypatch):
+    program_dir = tmp_path / program
+    program_dir.mkdir()
+    references = ROOT / "project10" / program
+    for source in references.glob("*.jack"):
+        shutil.copyfile(source, program_dir / source.name)
+    argv = ["jack_analyzer.py", "--source", str(program_dir), *MODES[mode]]
+    monkeypatch.setattr(sys, "argv", argv)
+    jack_analyzer.main()
+
+    for source in sorted(program_dir.glob("*.jack")):
+        for suffix in ["T", ""]:
+            output = program_dir / f"{source.stem}{suffix}-new.xml"
+            reference = references / f"{source.stem}{suffix}.xml"
+            assert _lines(output) == _lines(reference), output.name
+
+
+@pytest.mark.parametrize("name", list(EDGE_CASES))
+def test_tokenizers_agree_on_edge_cases(name, tmp_path: pathlib.Path):
+    source = tmp_path / "Main.jack"
+    source.write_text(EDGE_CASES[name])
+    tokens = _tokens(JackTokenizer(source))
+    assert _tokens(StreamingJackTokenizer(source, chunk_size=1)) == tokens
+    assert _tokens(StreamingJackTokenizer(source, chunk_size=7)) == tokens
+    assert tokens[0][1] == "class"
+    assert tokens[-1][1] == "}"
+
+
+def test_comment_markers_stay_in_strings(tmp_path: pathlib.Path):
+    source = tmp_path / "Main.jack"
+    source.write_text(EDGE_CASES["comment markers in strings"])
+    strings = [
+        value
+        for token_type, value, _ in _tokens(JackTokenizer(source))
+        if token_type == jack_analyzer.TokenType.STRING_CONST
+    ]
+    assert strings == ["a // b /* c */ d", "*/"]
+
+
+@pytest.mark.parametrize(
+    "source", sorted(ROOT.glob("project10/*/*.jack")), ids=lambda path: path.stem
+)
+def test_streaming_tokenizer_across_chunk_boundaries(source: pathlib.Path):
+    # With a chunk of one character every token, comment and string ends at
+    # the edge of the window
+    tokens = _tokens(JackTokenizer(source))
+    assert _tokens(StreamingJackTokenizer(source, chunk_size=1)) == tokens
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_deep_nesting(stream, tmp_path: pathlib.Path):
+    # Deeper than the recursion limit, in parentheses and unary operators
+    depth = sys.getrecursionlimit() * 2
+    source = tmp_path / "Main.jack"
+    source.write_text(
+        "class Main {\n"
+        "    function int main() {\n"
+        "        var int x;\n"
+        f"        let x = {'(' * depth}1{')' * depth};\n"
+        f"        let x = {'-' * depth}x;\n"
+        "        return x;\n"
+        "    }\n"
+        "}\n"
+    )
+    analyze(source, ["xml", "json", "vm"], stream=stream)
+    xml = (tmp_path / "Main-new.xml").read_text()
+    assert xml.count("<term>") == 2 * depth + 3
+    assert xml.count("<expression>") == depth + 3
@@ -0,0 +1,302 @@
+import io
+
+import json
+
+import pathlib
+
+import re
+
+import shutil
+
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "project8"))
+
+import toolchain
+
+from assembler import Parser, SymbolTable, assemble
+
+import jack_analyzer
+
+from jack_analyzer import string_pool
+
+from vm_interpreter import VMInterpreter, VMTestScript
+
+from vm_translator import TranslationCache, translate
+
+COURSE_VME_TESTS = sorted(ROOT.glob("project8/*/*/*VME.tst"))
+
+# Jack programs under project10 with a VM emulator test (<Name>VME.tst) and a
+# CPU emulator test (<Name>.tst) sharing <Name>.cmp, and whether they are
+# compiled with --pool-strings
+JACK_PROGRAMS = {
+    "ArraysObjects": False,
+    "ConstantFolding": False,
+    "PooledStrings": True,
+}
+
+REPEAT_PATTERN = re.compile(r"repeat\s+(\d+)\s*\{\s*ticktock;\s*\}")
+OUTPUT_LIST_PATTERN = re.compile(r"output-list([^;]*);")
+
+
+def _matches_cmp(outputs, cmp_file: pathlib.Path):
+    # Like the course tools, compare cell by cell and ignore the spacing
+    expected = cmp_file.read_text(encoding="UTF-8").split()
+    return "\n".join(outputs).split() == expected
+
+
+def _run_vme_test(vm_dir: pathlib.Path, tst_file: pathlib.Path):
+    interpreter = VMInterpreter(
+        sorted(vm for vm in vm_dir.iterdir() if vm.suffix == ".vm")
+    )
+    # Like the VM emulator, tests start directly at Sys.init without a frame
+    if interpreter.has_function("Sys.init"):
+        interpreter.enter("Sys.init")
+    return VMTestScript(tst_file).run(interpreter)
+
+
+def _signed(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _run_hack(hack_file: pathlib.Path, cycles):
+    # A model of the Hack CPU that runs the program from ROM address 0
+    rom = [int(line, 2) for line in hack_file.read_text().split()]
+    ram = [0] * 32768
+    a = d = pc = 0
+    for _ in range(cycles):
+        instruction = rom[pc]
+        if instruction & 0x8000 == 0:
+            a = instruction
+            pc += 1
+            continue
+        comp = (instruction >> 6) & 0x7F
+        x = d
+        y = ram[a] if comp & 0x40 else a
+        if comp & 0x20:
+            x = 0
+        if comp & 0x10:
+            x = ~x & 0xFFFF
+        if comp & 0x08:
+            y = 0
+        if comp & 0x04:
+            y = ~y & 0xFFFF
+        out = (x + y) & 0xFFFF if comp & 0x02 else x & y
+        if comp & 0x01:
+            out = ~out & 0xFFFF
+        address = a
+        if instruction & 0x08:
+            ram[address] = out
+        if instruction & 0x20:
+            a = out
+        if instruction & 0x10:
+            d = out
+        value = _signed(out)
+        jump = instruction & 0x07
+        if (
+            (jump & 0x04 and value < 0)
+            or (jump & 0x02 and value == 0)
+            or (jump & 0x01 and value > 0)
+        ):
+            pc = address
+        else:
+            pc += 1
+    return ram
+
+
+def _run_cpu_test(hack_file: pathlib.Path, tst_file: pathlib.Path):
+    # Runs the repeat { ticktock; } block of a CPU emulator test and formats
+    # its output-list of RAM cells
+    source = re.sub(r"//[^\n]*", "", tst_file.read_text(encoding="UTF-8"))
+    ram = _run_hack(hack_file, int(REPEAT_PATTERN.search(source).group(1)))
+    names = [
+        VMTestScript.OUTPUT_PATTERN.fullmatch(word).group(1)
+        for word in OUTPUT_LIST_PATTERN.search(source).group(1).split()
+    ]
+    values = [str(_signed(ram[int(name[len("RAM[") : -1])])) for name in names]
+    return [f"| {' | '.join(names)} |", f"| {' | '.join(values)} |"]
+
+
+def _variable_addresses(asm_file: pathlib.Path):
+    # RAM addresses that the assembler gives the variables of a program, in
+    # order of first use from RAM[16]
+    commands = asm_file.read_text(encoding="UTF-8").split()
+    labels = {command[1:-1] for command in commands if command.startswith("(")}
+    symbols = SymbolTable()
+    variables = {}
+    for command in commands:
+        symbol = command[1:]
+        if not command.startswith("@") or symbol.isdigit():
+            continue
+        if symbol not in labels and not symbols.contains(symbol):
+            variables.setdefault(symbol, 16 + len(variables))
+    return variables
+
+
+def _pooled_main(num_statics, num_literals):
+    # A Main class whose statics and string literals, pooled, take
+    # num_statics + 2 * num_literals words of the static segment
+    names = ", ".join(f"s{i}" for i in range(num_statics))
+    statics = "".join(f"        let s{i} = {i};\n" for i in range(num_statics))
+    literals = "".join(f'        let t = "t{i}";\n' for i in range(num_literals))
+    return (
+        "class Main {\n"
+        f"    static int {names};\n"
+        "    function void main() {\n"
+        "        var String t;\n"
+        f"{statics}"
+        f"{literals}"
+        "        return;\n"
+        "    }\n"
+        "}\n"
+    )
+
+
+def _copy_program(name, tmp_path: pathlib.Path):
+    # The programs share the stand-ins for the OS classes in StandInOS
+    program_dir = tmp_path / name
+    shutil.copytree(ROOT / "project10" / name, program_dir)
+    for stub in (ROOT / "project10" / "StandInOS").glob("*.jack"):
+        shutil.copyfile(stub, program_dir / stub.name)
+    return program_dir
+
+
+def _build(name, tmp_path: pathlib.Path):
+    # Builds a copy of the program so that no output lands in the tree
+    program_dir = _copy_program(name, tmp_path)
+    toolchain.build(program_dir, emit=["vm", "asm"], pool_strings=JACK_PROGRAMS[name])
+    return program_dir
+
+
+@pytest.mark.parametrize(
+    "tst_file", COURSE_VME_TESTS, ids=[tst.stem for tst in COURSE_VME_TESTS]
+)
+def test_course_vme(tst_file: pathlib.Path):
+    outputs = _run_vme_test(tst_file.parent, tst_file)
+    cmp_file = tst_file.with_name(tst_file.stem.replace("VME", "") + ".cmp")
+    assert _matches_cmp(outputs, cmp_file)
+
+
+@pytest.mark.parametrize("name", list(JACK_PROGRAMS))
+def test_jack_program_on_vm(name, tmp_path: pathlib.Path):
+    program_dir = _build(name, tmp_path)
+    outputs = _run_vme_test(program_dir, program_dir / f"{name}VME.tst")
+    assert _matches_cmp(outputs, program_dir / f"{name}.cmp")
+
+
+@pytest.mark.parametrize("name", list(JACK_PROGRAMS))
+def test_jack_program_on_cpu(name, tmp_path: pathlib.Path):
+    program_dir = _build(name, tmp_path)
+    outputs = _run_cpu_test(program_dir / f"{name}.hack", program_dir / f"{name}.tst")
+    assert _matches_cmp(outputs, program_dir / f"{name}.cmp")
+
+
+def test_string_pool_rejects_static_overflow(tmp_path: pathlib.Path):
+    # 3 declared statics, and 120 literals that take a slot each in the class
+    # and in StringPool, are more than the 240 words of the static segment
+    literals = "".join(f'        let s = "s{i}";\n' for i in range(120))
+    source = tmp_path / "Main.jack"
+    source.write_text(
+        "class Main {\n"
+        "    static int a, b, c;\n"
+        "    function void main() {\n"
+        "        var String s;\n"
+        f"{literals}"
+        "        return;\n"
+        "    }\n"
+        "}\n"
+    )
+    with pytest.raises(ValueError, match="243 statics"):
+        string_pool([source])
+
+
+def test_string_pool_fills_the_static_segment(tmp_path: pathlib.Path):
+    # With the 1 static of Memory, 3 in Main and 117 literals pooled, the
+    # program has 238 statics. Together with the translator's FRAME and RET
+    # they take RAM[16..255] exactly, and one static more does not fit.
+    program_dir = _copy_program("PooledStrings", tmp_path)
+    main = program_dir / "Main.jack"
+    main.write_text(_pooled_main(3, 117))
+    toolchain.build(program_dir, emit=["asm"], pool_strings=True)
+    variables = _variable_addresses(program_dir / "PooledStrings.asm")
+    assert max(variables.values()) == 255
+
+    main.write_text(_pooled_main(4, 117))
+    sources = sorted(program_dir.glob("*.jack"))
+    with pytest.raises(ValueError, match="239 statics"):
+        string_pool(sources)
+
+
+def test_build_compiles_the_text_it_hashed(tmp_path: pathlib.Path, monkeypatch):
+    # A save right after the build has read a class must not be compiled and
+    # recorded under the key of the text that was read
+    program_dir = tmp_path / "Save"
+    program_dir.mkdir()
+    main = program_dir / "Main.jack"
+    original = "class Main { function int f() { return 1; } }\n"
+    saved = "class Main { function int f() { return 2; } }\n"
+    main.write_text(original)
+    read_source = toolchain._read_source
+
+    def read_then_save(path):
+        text = read_source(path)
+        path.write_text(saved)
+        return text
+
+    monkeypatch.setattr(toolchain, "_read_source", read_then_save)
+    store = toolchain.ArtifactStore(tmp_path / "store")
+    toolchain.build(program_dir, emit=["vm"], store=store)
+    assert "push constant 1" in (program_dir / "Main.vm").read_text()
+
+
+def test_translation_cache_matches_a_full_translation(tmp_path: pathlib.Path):
+    # Under --watch the asm of unchanged files comes from the cache, also
+    # after an edit that shifts the label counts of the files after it
+    program_dir = tmp_path / "StaticsTest"
+    shutil.copytree(ROOT / "project8" / "FunctionCalls" / "StaticsTest", program_dir)
+    vm_files = sorted(program_dir.glob("*.vm"))
+    cache = TranslationCache()
+
+    def translated(cache):
+        asm = io.StringIO()
+        translate(asm, vm_files, cache=cache)
+        return asm.getvalue()
+
+    translated(cache)
+    for old, new in [("constant 0", "constant 9"), ("constant 9", "constant 9\neq")]:
+        vm_files[0].write_text(vm_files[0].read_text().replace(old, new))
+        assert translated(cache) == translated(None)
+
+
+def test_trace_collects_worker_spans(tmp_path: pathlib.Path, monkeypatch):
+    program_dir = tmp_path / "Square"
+    shutil.copytree(ROOT / "project10" / "Square", program_dir)
+    trace_file = tmp_path / "trace.json"
+    argv = ["jack_analyzer.py", "--source", str(program_dir), "--jobs", "2"]
+    monkeypatch.setattr(sys, "argv", argv + ["--trace", str(trace_file)])
+    jack_analyzer.main()
+    trace = json.loads(trace_file.read_text())
+    files = sorted(span["args"]["file"] for span in trace["spans"])
+    assert files == ["Main.jack", "Square.jack", "SquareGame.jack"]
+    assert trace["counters"]["tokens"] == sum(
+        span["counters"]["tokens"] for span in trace["spans"]
+    )
+
+
+def test_assembler_lexes_a_list_of_lines():
+    # A list is lines as in a file, comments and all, like in lex_commands
+    lines = ["@1 // one", "  D = A ; JGT", "(END)", "// only a comment"]
+    with Parser(lines) as parser:
+        symbols = []
+        while parser.has_more_commands():
+            parser.advance()
+            symbols.append(parser.symbol())
+    assert symbols == ["1", None, "END"]
+    assert assemble(lines, verbose=False) == [
+        "0000000000000001",
+        "1110110000010001",
+    ]
@@ -0,0 +1,323 @@
+import argparse
+
+import hashlib
+
+import io
+
+import os
+
+import pathlib
+
+import sys
+
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent
+for project in ("project6", "project8", "project10"):
+    sys.path.insert(0, str(ROOT / project))
+
+import assembler
+
+import jack_analyzer
+
+import line_lexer
+
+import tracing
+
+import vm_translator
+
+import watcher
+
+from assembler import assemble
+
+from jack_analyzer import STRING_POOL, compile_vm, string_pool
+
+from vm_translator import translate
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def _tool_version(*modules):
+    return _digest(*(pathlib.Path(module.__file__).read_bytes() for module in modules))
+
+
+# A change to a tool, or to a module of this repo that it imports,
+# invalidates every artifact it produced
+TOOL_VERSIONS = {
+    "compile": _tool_version(jack_analyzer, tracing, watcher),
+    "link": _tool_version(vm_translator, line_lexer, tracing, watcher),
+    "assemble": _tool_version(assembler, line_lexer, tracing, watcher),
+}
+
+
+class ArtifactStore:
+    # Content-addressed store on disk. objects/<hash> holds an artifact under
+    # the hash of its content and actions/<key> names the object that a step
+    # produced from the inputs hashed into key. Steps with the same inputs
+    # share one object, however many builds or checkouts produce them.
+    def __init__(self, store_dir: pathlib.Path):
+        self._objects = store_dir / "objects"
+        self._actions = store_dir / "actions"
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._actions.mkdir(parents=True, exist_ok=True)
+
+    def lookup(self, key):
+        action = self._actions / key
+        if not action.is_file():
+            return None
+        artifact = self._objects / action.read_text()
+        if not artifact.is_file():
+            return None
+        return artifact.read_text()
+
+    def record(self, key, artifact):
+        digest = _digest(artifact)
+        self._write(self._objects / digest, artifact)
+        self._write(self._actions / key, digest)
+
+    def _write(self, path: pathlib.Path, text):
+        # Written under a temporary name and renamed, so readers never see a
+        # partial file
+        partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        partial.write_text(text)
+        partial.replace(path)
+
+
+class MemoryStore:
+    # Keeps artifacts in memory for --watch, in front of an optional store on
+    # disk, so rebuilding after an edit reads nothing for unchanged classes
+    def __init__(self, backing: ArtifactStore = None):
+        self._artifacts = {}
+        self._backing = backing
+
+    def lookup(self, key):
+        artifact = self._artifacts.get(key)
+        if artifact is None and self._backing is not None:
+            artifact = self._backing.lookup(key)
+            if artifact is not None:
+                self._artifacts[key] = artifact
+        return artifact
+
+    def record(self, key, artifact):
+        self._artifacts[key] = artifact
+        if self._backing is not None:
+            self._backing.record(key, artifact)
+
+
+class BuildGraph:
+    # Runs build steps whose output is a text artifact. A step is skipped
+    # when the store holds an artifact for the same tool version and inputs.
+    def __init__(self, store: ArtifactStore = None):
+        self._store = store
+        self.ran = []
+        self.cached = []
+        self.timings = {}
+
+    def step(self, stage, name, inputs, action):
+        start = time.perf_counter()
+        with tracing.span(stage, step=name) as span:
+            key = _digest(stage, TOOL_VERSIONS[stage], *inputs)
+            artifact = None
+            if self._store is not None:
+                artifact = self._store.lookup(key)
+            span.set("cached", artifact is not None)
+            if artifact is None:
+                artifact = action()
+                if self._store is not None:
+                    self._store.record(key, artifact)
+                self.ran.append(name)
+            else:
+                self.cached.append(name)
+        self.timings[stage] = self.timings.get(stage, 0.0) + (
+            time.perf_counter() - start
+        )
+        return artifact
+
+
+def _program_files(source: pathlib.Path):
+    # Jack classes to compile and ready-made .vm files, such as the OS, that
+    # are linked as they are unless a class of the same name is compiled
+    files = list(source.iterdir()) if source.is_dir() else [source]
+    jack_files = sorted(f for f in files if f.suffix == ".jack")
+    vm_files = sorted(f for f in files if f.suffix == ".vm")
+    return jack_files, vm_files
+
+
+def _output_path(source: pathlib.Path, suffix):
+    if source.is_dir():
+        return source / (source.name + suffix)
+    return source.with_suffix(suffix)
+
+
+def _read_source(path: pathlib.Path):
+    # Decoded like a file opened in text mode, with universal newlines
+    with open(path, "r", encoding="UTF-8") as f:
+        return f.read()
+
+
+def _commands_text(commands):
+    return "".join(f"{command}\n" for command in commands)
+
+
+def _link(texts):
+    # The stages take the lines of their input as a list, which they lex
+    # without another copy of the text
+    asm = io.StringIO()
+    translate(
+        out_file=asm,
+        vm_files=[(f"{name}.vm", text.splitlines()) for name, text in texts.items()],
+    )
+    return asm.getvalue()
+
+
+def _assemble(asm):
+    return "".join(f"{code}\n" for code in assemble(asm.splitlines(), verbose=False))
+
+
+def build(
+    source: pathlib.Path,
+    out_file=None,
+    libs=(),
+    emit=(),
+    pool_strings=False,
+    store: ArtifactStore = None,
+):
+    # Jack -> VM -> asm -> hack in one process. Every stage hands its output
+    # to the next one in memory; .vm and .asm files are written only when
+    # they are listed in emit. Each class is a compile step of its own, so
+    # with a store only the classes that changed are compiled again.
+    with tracing.span("build", source=str(source)):
+        graph = BuildGraph(store)
+        jack_files, vm_files = _program_files(source)
+        if len(jack_files) == 0:
+            raise ValueError(f"no .jack files found in {source}")
+
+        options = "pool-strings" if pool_strings else ""
+        texts = {}
+        # Each class is read once and compiled from the same text that its
+        # key is made of, so a save during the build cannot record the code
+        # of one version under the key of another
+        sources = {jack_file: _read_source(jack_file) for jack_file in jack_files}
+        for jack_file, content in sources.items():
+            texts[jack_file.stem] = graph.step(
+                "compile",
+                f"compile {jack_file.stem}",
+                [options, content],
+                lambda: _commands_text(compile_vm(jack_file, pool_strings, content)),
+            )
+        if pool_strings:
+            texts[STRING_POOL] = graph.step(
+                "compile",
+                f"compile {STRING_POOL}",
+                [options, *sources.values()],
+                lambda: _commands_text(string_pool(jack_files, sources)),
+            )
+
+        if "vm" in emit:
+            out_dir = source if source.is_dir() else source.parent
+            for name, text in texts.items():
+                (out_dir / f"{name}.vm").write_text(text)
+
+        for lib in libs:
+            vm_files += _program_files(lib)[1] if lib.is_dir() else [lib]
+        for vm_file in vm_files:
+            # A StringPool.vm left by an earlier pooled build is never linked
+            if vm_file.stem not in texts and vm_file.stem != STRING_POOL:
+                texts[vm_file.stem] = vm_file.read_text(encoding="UTF-8")
+
+        # The link depends on the content of every VM file, not on how it was
+        # made, so a class edit that compiles to the same code stops here
+        link_inputs = [f"{name}:{_digest(text)}" for name, text in texts.items()]
+        asm = graph.step("link", "link", link_inputs, lambda: _link(texts))
+        if "asm" in emit:
+            _output_path(source, ".asm").write_text(asm)
+
+        hack = graph.step(
+            "assemble", "assemble", [_digest(asm)], lambda: _assemble(asm)
+        )
+        if out_file is None:
+            out_file = _output_path(source, ".hack")
+        out_file.write_text(hack)
+    return out_file, hack.count("\n"), graph
+
+
+def _watched_files(source: pathlib.Path, libs):
+    # Every input. Emitted .vm files of compiled classes are outputs and are
+    # left out, or writing them would trigger another build.
+    jack_files, vm_files = _program_files(source)
+    for lib in libs:
+        vm_files += _program_files(lib)[1] if lib.is_dir() else [lib]
+    classes = {jack_file.stem for jack_file in jack_files}
+    classes.add(STRING_POOL)
+    return jack_files + [vm_file for vm_file in vm_files if vm_file.stem not in classes]
+
+
+def watch(source: pathlib.Path, interval, store: ArtifactStore = None, **options):
+    # Rebuilds when an input changes. Artifacts stay in memory between
+    # builds, so only classes whose content changed are compiled again.
+    store = MemoryStore(store)
+    libs = options.get("libs", ())
+    watcher.watch(
+        source,
+        lambda: _watched_files(source, libs),
+        lambda: _report(*build(source, store=store, **options), store=store),
+        interval,
+    )
+
+
+def _report(out_file, size, graph, store=None):
+    stages = " ".join(
+        f"{stage} {seconds:.3f}s" for stage, seconds in graph.timings.items()
+    )
+    print(f"{out_file}: {size} instructions ({stages})")
+    if store is not None:
+        ran = ", ".join(graph.ran) if len(graph.ran) != 0 else "nothing"
+        print(f"ran: {ran}; {len(graph.cached)} steps cached")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, required=True)
+    parser.add_argument("--out", type=str, default=None)
+    parser.add_argument("--lib", type=str, action="append", default=[])
+    parser.add_argument(
+        "--emit", type=str, action="append", choices=["vm", "asm"], default=[]
+    )
+    parser.add_argument("--pool-strings", action="store_true")
+    parser.add_argument("--cache", type=str, default=None)
+    watcher.add_arguments(parser)
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+
+    source = pathlib.Path(args.source)
+    store = ArtifactStore(pathlib.Path(args.cache)) if args.cache else None
+    options = {
+        "out_file": pathlib.Path(args.out) if args.out is not None else None,
+        "libs": [pathlib.Path(lib) for lib in args.lib],
+        "emit": args.emit,
+        "pool_strings": args.pool_strings,
+    }
+    with tracing.traced(args.trace, args.trace_format):
+        if args.watch:
+            watch(source, args.interval, store=store, **options)
+            return
+
+        try:
+            result = build(source, store=store, **options)
+        except Exception as e:
+            print(f"{args.source}: failed: {type(e).__name__}: {e}")
+            sys.exit(1)
+    _report(*result, store=store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import contextlib
+
+import json
+
+import os
+
+import sys
+
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FORMATS = ("json", "chrome")
+
+# The tracer that span() and count() report to. None turns both into no-ops
+# that cost one global lookup, so the tools call them unconditionally.
+_tracer = None
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Span:
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self.name = name
+        self.args = args
+        self.pid = os.getpid()
+        self.counters = {}
+        self.children = []
+        self.start = None
+        self.end = None
+        self.peak_rss_kb = None
+
+    def __enter__(self):
+        self._tracer._open(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter_ns()
+        self.peak_rss_kb = _peak_rss_kb()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc_value}"
+        self._tracer._close(self)
+        return False
+
+    def __getstate__(self):
+        # A span sent back from a worker process leaves its tracer behind
+        state = self.__dict__.copy()
+        state["_tracer"] = None
+        return state
+
+    def set(self, key, value):
+        self.args[key] = value
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "args": self.args,
+            "start_ms": (self.start - origin) / 1e6,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "counters": self.counters,
+            "peak_rss_kb": self.peak_rss_kb,
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    # Collects nested spans and counters. A counter is added to the
+    # innermost open span and to the totals of the whole trace, and a span
+    # hands its counters on to its parent when it closes.
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.roots = []
+        self.counters = {}
+        self._stack = []
+
+    def span(self, name, args):
+        return Span(self, name, args)
+
+    def count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if len(self._stack) != 0:
+            counters = self._stack[-1].counters
+            counters[name] = counters.get(name, 0) + amount
+
+    def merge(self, spans, counters):
+        # Adds the spans and counters of another tracer, such as one in a
+        # worker process, as if they had been recorded here. perf_counter_ns
+        # reads a clock that all processes share, so their times line up.
+        for span in spans:
+            if len(self._stack) != 0:
+                self._stack[-1].children.append(span)
+            else:
+                self.roots.append(span)
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def to_json(self):
+        return {
+            "spans": [span.to_dict(self.origin) for span in self.roots],
+            "counters": self.counters,
+            "peak_rss_kb": _peak_rss_kb(),
+        }
+
+    def to_chrome_trace(self):
+        # Trace Event Format, as read by chrome://tracing and Perfetto:
+        # a complete ("X") event per span and a counter ("C") event for the
+        # peak memory when each span ends, under the process that recorded it
+        events = []
+        spans = list(reversed(self.roots))
+        while len(spans) != 0:
+            span = spans.pop()
+            start = (span.start - self.origin) / 1e3
+            end = (span.end - self.origin) / 1e3
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": end - start,
+                    "pid": span.pid,
+                    "tid": 0,
+                    "args": {**span.args, **span.counters},
+                }
+            )
+            if span.peak_rss_kb is not None:
+                events.append(
+                    {
+                        "name": "peak_rss_kb",
+                        "ph": "C",
+                        "ts": end,
+                        "pid": span.pid,
+                        "args": {"peak_rss_kb": span.peak_rss_kb},
+                    }
+                )
+            spans.extend(reversed(span.children))
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": self.counters, "peak_rss_kb": _peak_rss_kb()},
+        }
+
+    def write(self, trace_file, trace_format="json"):
+        if trace_format == "json":
+            trace = self.to_json()
+        elif trace_format == "chrome":
+            trace = self.to_chrome_trace()
+        else:
+            raise ValueError(f"Unknown trace format: {trace_format}")
+        with open(trace_file, "w", encoding="UTF-8") as f:
+            json.dump(trace, f, indent=2)
+
+    def _open(self, span):
+        if len(self._stack) != 0:
+            self._stack[-1].children.append(span)
+        else:
+            self.roots.append(span)
+        self._stack.append(span)
+
+    def _close(self, span):
+        # Spans are context managers, so they close in reverse order
+        self._stack.pop()
+        if len(self._stack) != 0:
+            counters = self._stack[-1].counters
+            for name, amount in span.counters.items():
+                counters[name] = counters.get(name, 0) + amount
+
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def span(name, **args):
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, args)
+
+
+def count(name, amount=1):
+    if _tracer is not None:
+        _tracer.count(name, amount)
+
+
+def merge(spans, counters):
+    if _tracer is not None:
+        _tracer.merge(spans, counters)
+
+
+def add_arguments(parser):
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--trace-format", type=str, choices=FORMATS, default="json")
+
+
+@contextlib.contextmanager
+def traced(trace_file=None, trace_format="json"):
+    # Traces the block to trace_file, if one is given. The trace is written
+    # even when the block fails, since that is often when it is wanted.
+    if trace_file is None:
+        yield None
+        return
+    tracer = start()
+    try:
+        yield tracer
+    finally:
+        stop()
+        tracer.write(trace_file, trace_format)
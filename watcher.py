@@ -0,0 +1,50 @@
+import time
+
+
+def add_arguments(parser):
+    parser.add_argument("--watch", action="store_true")
+    parser.add_argument("--interval", type=float, default=0.2)
+
+
+def snapshot(paths):
+    # Modification time and size of every file. Polling these keeps the
+    # tools within the standard library, where inotify is not available.
+    files = {}
+    for path in paths:
+        stat = path.stat()
+        files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def watch(name, list_inputs, run, interval=0.2, log=None):
+    # Calls run() once and again whenever one of the files that list_inputs()
+    # returns is added, removed or changed, until interrupted. A failed run is
+    # reported and the next change is waited for. Progress goes to log, which
+    # defaults to stdout.
+    previous = None
+    try:
+        while True:
+            try:
+                files = snapshot(list_inputs())
+            except FileNotFoundError:
+                # A file was replaced while listing, as editors do on save
+                files = previous
+            if files != previous:
+                previous = files
+                start = time.perf_counter()
+                try:
+                    run()
+                except Exception as e:
+                    print(
+                        f"{name}: failed: {type(e).__name__}: {e}", file=log, flush=True
+                    )
+                else:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    print(
+                        f"built in {elapsed:.1f}ms, watching {name}",
+                        file=log,
+                        flush=True,
+                    )
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass